@@ -5,28 +5,59 @@ Manages stock using Excel files with pandas
 
 from flask import Flask, render_template, request, jsonify
 import pandas as pd
+import gzip
+import json
 import os
-from datetime import datetime
+import threading
 import cloud_sync
 import config
+import history_store
+import lan_sync
+import reorder
+import reports
+import sales_stats
+import stock_store
 
 app = Flask(__name__)
 
 # File paths
 STOCK_FILE = 'data/stock.xlsx'
-HISTORIQUE_FILE = 'data/historique.xlsx'
+HISTORIQUE_FILE = 'data/historique.xlsx'  # Legacy single-sheet history, migrated on startup
+HISTORY_DIR = 'data/historique'
 
 # Cloud sync configuration
 SPREADSHEET_ID = config.SPREADSHEET_ID
 SERVICE_ACCOUNT_FILE = config.SERVICE_ACCOUNT_FILE
 
+# Terminals leave cloud sync to the authority so they never overwrite its data
+TERMINAL_CLOUD_MESSAGE = {
+    'success': False,
+    'message': 'Serveur principal injoignable - la synchronisation cloud se fait depuis le poste principal'
+}
+
+# Responses larger than this are gzip-compressed when the client accepts it
+GZIP_MIN_SIZE = 4096
+
+# Latest authority stock waiting to be mirrored on a terminal, and its writer
+_mirror = {
+    'content': None,
+    'thread': None,
+}
+_mirror_lock = threading.Lock()
+_mirror_write_lock = threading.Lock()
+
 # Initialize Excel files if they don't exist
 def init_excel_files():
     """Create Excel files with proper structure if they don't exist"""
     os.makedirs('data', exist_ok=True)
     
+    # Split the legacy historique.xlsx into monthly partitions (one-time)
+    migrated = history_store.migrate_legacy_history(HISTORIQUE_FILE, HISTORY_DIR)
+    if migrated is not None:
+        print(f"📦 Historique migré en partitions mensuelles ({migrated} ventes)")
+    
     # Try to restore from cloud if files are missing
-    files_missing = not os.path.exists(STOCK_FILE) or not os.path.exists(HISTORIQUE_FILE)
+    files_missing = not os.path.exists(STOCK_FILE) or not history_store.exists(HISTORY_DIR)
     
     if files_missing and cloud_sync.check_internet_connection():
         print("📥 Fichiers manquants - Tentative de restauration depuis le cloud...")
@@ -34,7 +65,7 @@ def init_excel_files():
             SPREADSHEET_ID,
             SERVICE_ACCOUNT_FILE,
             STOCK_FILE,
-            HISTORIQUE_FILE
+            HISTORY_DIR
         )
         if result['success']:
             print(f"✅ {result['message']}")
@@ -54,26 +85,26 @@ def init_excel_files():
         df_stock = pd.DataFrame(sample_data)
         df_stock.to_excel(STOCK_FILE, index=False)
     
-    # Initialize historique.xlsx
-    if not os.path.exists(HISTORIQUE_FILE):
-        df_hist = pd.DataFrame(columns=['date', 'nom_article', 'quantite', 'prix_total'])
-        df_hist.to_excel(HISTORIQUE_FILE, index=False)
+    # Initialize partitioned history
+    history_store.init_history(HISTORY_DIR)
 
 # Helper function to read stock
 def read_stock():
-    """Read stock data from Excel file"""
+    """Read stock data (typed, indexed by id) from the in-memory cache of the Excel file"""
+    # Local changes on a terminal apply on top of the last mirrored stock
+    if _mirror['thread'] is not None:
+        flush_stock_mirror()
     try:
-        df = pd.read_excel(STOCK_FILE)
-        return df
+        return stock_store.load(STOCK_FILE).copy()
     except Exception as e:
         print(f"Error reading stock: {e}")
-        return pd.DataFrame(columns=['id', 'nom_article', 'stock', 'prix', 'min_stock'])
+        return stock_store.empty_stock()
 
 # Helper function to write stock
 def write_stock(df):
     """Write stock data to Excel file"""
     try:
-        df.to_excel(STOCK_FILE, index=False)
+        stock_store.save(STOCK_FILE, df)
         return True
     except PermissionError as e:
         print(f"Error writing stock - File is locked: {e}")
@@ -83,30 +114,84 @@ def write_stock(df):
         print(f"Error writing stock: {e}")
         return False
 
+# Helper functions to mirror the authority's stock on a terminal
+def write_stock_mirror(content):
+    """Replace the local stock copy with the authority's, if it differs"""
+    if content != stock_store.encoded_stock(STOCK_FILE):
+        write_stock(pd.DataFrame(json.loads(content)))
+
+def save_stock_mirror(content):
+    """
+    Keep the local stock copy in step with the authority's, for offline use
+
+    Rewriting stock.xlsx takes seconds on a large catalog, so the GET is
+    answered at once and a single background thread writes the latest
+    content; a burst of GETs ends in one write. read_stock() waits for it,
+    so a change made offline right after is not overwritten.
+    """
+    with _mirror_lock:
+        _mirror['content'] = content
+        if _mirror['thread'] is None:
+            _mirror['thread'] = threading.Thread(target=_mirror_worker, name='stock-mirror', daemon=True)
+            _mirror['thread'].start()
+
+def flush_stock_mirror():
+    """Write the pending mirror content now, if any"""
+    with _mirror_write_lock:
+        with _mirror_lock:
+            content = _mirror['content']
+            _mirror['content'] = None
+        if content is not None:
+            try:
+                write_stock_mirror(content)
+            except Exception as e:
+                print(f"Error mirroring stock: {e}")
+
+def _mirror_worker():
+    """Write queued mirror contents until none is left"""
+    while True:
+        with _mirror_lock:
+            if _mirror['content'] is None:
+                _mirror['thread'] = None
+                return
+        flush_stock_mirror()
+
+def refresh_stock_mirror():
+    """Pull the authority's stock once every queued operation was replayed"""
+    status, content, _ = lan_sync.forward('GET', '/api/stock')
+    if status == 200:
+        # Already on the replay worker: written before the id map is cleared,
+        # replacing any older snapshot still waiting for the background writer
+        with _mirror_write_lock:
+            with _mirror_lock:
+                _mirror['content'] = None
+            write_stock_mirror(content)
+
+# Helper function to send pre-encoded JSON
+def json_bytes_response(body, gzip_body=None):
+    """Return JSON bytes as a response, gzip-compressed for large payloads"""
+    response = app.response_class(body, mimetype='application/json')
+    if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip_body if gzip_body is not None else gzip.compress(body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 # Helper function to add to history
 def add_to_history(nom_article, quantite, prix_total):
-    """Add a sale to the history file"""
+    """Add a sale to the current month's history partition"""
+    date = pd.Timestamp.now()
     try:
-        # Read existing history
-        if os.path.exists(HISTORIQUE_FILE):
-            df_hist = pd.read_excel(HISTORIQUE_FILE)
-        else:
-            df_hist = pd.DataFrame(columns=['date', 'nom_article', 'quantite', 'prix_total'])
-        
-        # Add new sale
-        new_sale = pd.DataFrame([{
-            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'nom_article': nom_article,
-            'quantite': quantite,
-            'prix_total': prix_total
-        }])
-        
-        df_hist = pd.concat([df_hist, new_sale], ignore_index=True)
-        df_hist.to_excel(HISTORIQUE_FILE, index=False)
-        return True
+        version = history_store.append_sale(HISTORY_DIR, nom_article, quantite, prix_total, date)
     except Exception as e:
         print(f"Error adding to history: {e}")
         return False
+    # The sale is recorded: a cache that misses it rebuilds from the history
+    try:
+        sales_stats.record_sale(nom_article, quantite, prix_total, version, date)
+    except Exception as e:
+        print(f"Error updating sales caches: {e}")
+    return True
 
 # Routes
 @app.route('/')
@@ -115,13 +200,29 @@ def index():
     return render_template('index.html')
 
 @app.route('/api/stock', methods=['GET'])
+@lan_sync.forwarded(on_success=save_stock_mirror)
 def get_stock():
     """Get all stock items"""
-    df = read_stock()
-    stock_list = df.to_dict('records')
-    return jsonify(stock_list)
+    try:
+        # Clients holding the current version get a bodyless 304
+        etag = stock_store.stock_etag(STOCK_FILE)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        body = stock_store.encoded_stock(STOCK_FILE)
+        gzip_body = stock_store.encoded_stock(STOCK_FILE, compressed=True) if len(body) >= GZIP_MIN_SIZE else None
+    except Exception as e:
+        print(f"Error reading stock: {e}")
+        return json_bytes_response(b'[]')
+    response = json_bytes_response(body, gzip_body)
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/stock', methods=['POST'])
+@lan_sync.forwarded(queue_offline=True)
+@lan_sync.idempotent
 def add_stock():
     """Add a new stock item"""
     try:
@@ -144,7 +245,7 @@ def add_stock():
         df = pd.concat([df, new_item], ignore_index=True)
         
         if write_stock(df):
-            return jsonify({'success': True, 'message': 'Article ajouté avec succès'})
+            return jsonify({'success': True, 'message': 'Article ajouté avec succès', 'id': new_id})
         else:
             return jsonify({'success': False, 'message': 'Erreur lors de l\'ajout'}), 500
             
@@ -152,6 +253,8 @@ def add_stock():
         return jsonify({'success': False, 'message': str(e)}), 400
 
 @app.route('/api/stock/<int:item_id>', methods=['PUT'])
+@lan_sync.forwarded(queue_offline=True)
+@lan_sync.idempotent
 def update_stock(item_id):
     """Update an existing stock item"""
     try:
@@ -159,15 +262,16 @@ def update_stock(item_id):
         df = read_stock()
         
         # Find the item
-        idx = df[df['id'] == item_id].index
-        if len(idx) == 0:
+        if item_id not in df.index:
             return jsonify({'success': False, 'message': 'Article non trouvé'}), 404
         
         # Update the item
-        df.loc[idx, 'nom_article'] = data['nom_article']
-        df.loc[idx, 'stock'] = int(data['stock'])
-        df.loc[idx, 'prix'] = float(data['prix'])
-        df.loc[idx, 'min_stock'] = int(data['min_stock'])
+        stock_store.set_item(df, item_id, {
+            'nom_article': data['nom_article'],
+            'stock': int(data['stock']),
+            'prix': float(data['prix']),
+            'min_stock': int(data['min_stock'])
+        })
         
         if write_stock(df):
             return jsonify({'success': True, 'message': 'Article modifié avec succès'})
@@ -178,21 +282,20 @@ def update_stock(item_id):
         return jsonify({'success': False, 'message': str(e)}), 400
 
 @app.route('/api/stock/<int:item_id>', methods=['DELETE'])
+@lan_sync.forwarded(queue_offline=True)
+@lan_sync.idempotent
 def delete_stock(item_id):
     """Delete a stock item"""
     try:
         df = read_stock()
         
         # Check if item exists
-        initial_count = len(df)
-        
-        # Find and remove the item
-        df = df[df['id'] != item_id]
-        
-        # Verify item was found
-        if len(df) == initial_count:
+        if item_id not in df.index:
             return jsonify({'success': False, 'message': 'Article non trouvé'}), 404
         
+        # Remove the item
+        df = df.drop(index=item_id)
+        
         if write_stock(df):
             return jsonify({'success': True, 'message': 'Article supprimé avec succès'})
         else:
@@ -202,6 +305,8 @@ def delete_stock(item_id):
         return jsonify({'success': False, 'message': str(e)}), 400
 
 @app.route('/api/vente', methods=['POST'])
+@lan_sync.forwarded(queue_offline=True)
+@lan_sync.idempotent
 def process_sale():
     """Process a sale transaction"""
     try:
@@ -212,14 +317,18 @@ def process_sale():
         df = read_stock()
         
         # Find the article
-        idx = df[df['id'] == article_id].index
-        if len(idx) == 0:
+        if article_id not in df.index:
             return jsonify({'success': False, 'message': 'Article non trouvé'}), 404
         
         # Get current stock and price
-        current_stock = int(df.loc[idx[0], 'stock'])
-        prix = float(df.loc[idx[0], 'prix'])
-        nom_article = df.loc[idx[0], 'nom_article']
+        if pd.isna(df.at[article_id, 'stock']) or pd.isna(df.at[article_id, 'prix']):
+            return jsonify({
+                'success': False,
+                'message': "Stock ou prix illisible dans stock.xlsx - corrigez l'article avant de vendre"
+            }), 400
+        current_stock = int(df.at[article_id, 'stock'])
+        prix = float(df.at[article_id, 'prix'])
+        nom_article = df.at[article_id, 'nom_article']
         
         # Validate stock availability
         if current_stock < quantite:
@@ -229,77 +338,164 @@ def process_sale():
             }), 400
         
         # Update stock
-        df.loc[idx, 'stock'] = current_stock - quantite
+        new_stock = current_stock - quantite
+        df.at[article_id, 'stock'] = new_stock
         
         # Calculate total price
         prix_total = prix * quantite
         
-        # Save stock and history
-        if write_stock(df) and add_to_history(nom_article, quantite, prix_total):
-            return jsonify({
-                'success': True, 
-                'message': f'Vente effectuée avec succès! Total: {prix_total} DA',
-                'prix_total': prix_total
-            })
-        else:
+        # Save stock and history: the sale is applied entirely or not at all
+        if not write_stock(df):
             return jsonify({'success': False, 'message': 'Erreur lors de la vente'}), 500
+        lan_sync.mark_applied()
+
+        if not add_to_history(nom_article, quantite, prix_total):
+            # Put the units back so a retry does not take them a second time
+            df.at[article_id, 'stock'] = current_stock
+            if write_stock(df):
+                lan_sync.mark_applied(False)
+                return jsonify({'success': False, 'message': 'Erreur lors de la vente - stock inchangé'}), 500
+            return jsonify({
+                'success': False,
+                'applied': True,
+                'message': "Stock mis à jour mais vente absente de l'historique - ne pas refaire la vente"
+            }), 500
+
+        return jsonify({
+            'success': True, 
+            'message': f'Vente effectuée avec succès! Total: {prix_total} DA',
+            'prix_total': prix_total,
+            'article_id': article_id,
+            'stock': new_stock
+        })
             
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 400
 
 @app.route('/api/alerts', methods=['GET'])
+@lan_sync.forwarded()
 def get_alerts():
     """Get low stock alerts"""
     df = read_stock()
     # Find items where stock <= min_stock
-    alerts = df[df['stock'] <= df['min_stock']]
-    alert_list = alerts.to_dict('records')
-    return jsonify(alert_list)
+    # Articles with an unreadable stock or minimum are not alerts
+    alerts = df[(df['stock'] <= df['min_stock']).fillna(False).to_numpy(dtype=bool)]
+    return json_bytes_response(stock_store.dumps(stock_store.records(alerts)))
+
+@app.route('/api/reorder', methods=['GET'])
+@lan_sync.forwarded()
+def get_reorder_suggestions():
+    """Get sales velocity, days of cover and suggested reorder quantities"""
+    try:
+        lead_time = float(request.args.get('lead_time', reorder.DEFAULT_LEAD_TIME))
+        cover_days = float(request.args.get('cover_days', reorder.DEFAULT_COVER_DAYS))
+        
+        velocity = sales_stats.get(HISTORY_DIR)['velocity']
+        suggestions = reorder.suggest(read_stock(), velocity, lead_time, cover_days)
+        
+        # Only articles that need ordering unless ?all=1
+        if request.args.get('all') != '1':
+            suggestions = suggestions[suggestions['needs_reorder']]
+        
+        return json_bytes_response(stock_store.dumps(stock_store.records(suggestions)))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error computing reorder suggestions: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Helper function to send a memoized report
+def report_response(name, params, build):
+    """Return a report body computed once per stock/history version"""
+    body = reports.encoded_report(name, params, build, STOCK_FILE, HISTORY_DIR)
+    gzip_body = None
+    if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        gzip_body = reports.encoded_report(name, params, build, STOCK_FILE, HISTORY_DIR, compressed=True)
+    return json_bytes_response(body, gzip_body)
+
+@app.route('/api/reports/valuation', methods=['GET'])
+@lan_sync.forwarded()
+def get_valuation_report():
+    """Get the stock value on hand and the most valuable articles"""
+    try:
+        top = int(request.args.get('top', reports.DEFAULT_TOP))
+        return report_response('valuation', top, lambda df, sales: reports.valuation(df, top))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error computing valuation report: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/reports/dead-stock', methods=['GET'])
+@lan_sync.forwarded()
+def get_dead_stock_report():
+    """Get articles in stock without a sale for the last `days` days"""
+    try:
+        days = int(request.args.get('days', reports.DEFAULT_DEAD_DAYS))
+        limit = int(request.args.get('limit', reports.DEFAULT_LIMIT))
+        return report_response('dead-stock', (days, limit),
+                               lambda df, sales: reports.dead_stock(df, sales, days, limit))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error computing dead stock report: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/reports/abc', methods=['GET'])
+@lan_sync.forwarded()
+def get_abc_report():
+    """Get the ABC (Pareto) revenue class of every article"""
+    try:
+        limit = int(request.args.get('limit', reports.DEFAULT_LIMIT))
+        classe = request.args.get('classe', '').upper() or None
+        if classe not in (None, 'A', 'B', 'C'):
+            return jsonify({'success': False, 'message': 'Classe invalide (A, B ou C)'}), 400
+        return report_response('abc', (limit, classe),
+                               lambda df, sales: reports.abc(df, sales, limit, classe))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Error computing ABC report: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/historique', methods=['GET'])
+@lan_sync.forwarded()
 def get_history():
     """Get sales history with optional filtering"""
     try:
-        if os.path.exists(HISTORIQUE_FILE):
-            df_hist = pd.read_excel(HISTORIQUE_FILE)
-            
-            # Convert date column to datetime for filtering
-            df_hist['date'] = pd.to_datetime(df_hist['date'])
-            
-            # Get filter parameters
-            start_date = request.args.get('start_date')
-            end_date = request.args.get('end_date')
-            
-            # Apply date filters if provided
-            if start_date:
-                df_hist = df_hist[df_hist['date'] >= pd.to_datetime(start_date)]
-            if end_date:
-                # Add 1 day to end_date to include the entire day
-                df_hist = df_hist[df_hist['date'] <= pd.to_datetime(end_date) + pd.Timedelta(days=1)]
-            
-            # Calculate totals before converting to dict
+        # Get filter parameters
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        
+        start = pd.to_datetime(start_date) if start_date else None
+        # Add 1 day to end_date to include the entire day
+        end = pd.to_datetime(end_date) + pd.Timedelta(days=1) if end_date else None
+        
+        # Only the partitions overlapping the range are opened
+        df_hist = history_store.read_history(HISTORY_DIR, start, end)
+        
+        # Full-range totals come from the manifest, filtered ones from the rows
+        if start is None and end is None:
+            totals = history_store.get_totals(HISTORY_DIR)
+            total_amount = totals['total_amount']
+            total_quantity = totals['total_quantity']
+        else:
             total_amount = float(df_hist['prix_total'].sum()) if not df_hist.empty else 0
             total_quantity = int(df_hist['quantite'].sum()) if not df_hist.empty else 0
-            
-            # Sort by date descending
-            df_hist = df_hist.sort_values('date', ascending=False)
-            
-            # Convert dates back to string for JSON serialization
-            df_hist['date'] = df_hist['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
-            
-            history_list = df_hist.to_dict('records')
-            
-            return jsonify({
-                'sales': history_list,
-                'total_amount': total_amount,
-                'total_quantity': total_quantity
-            })
-        else:
-            return jsonify({
-                'sales': [],
-                'total_amount': 0,
-                'total_quantity': 0
-            })
+        
+        # Sort by date descending
+        df_hist = df_hist.sort_values('date', ascending=False)
+        
+        # Convert dates back to string for JSON serialization
+        df_hist['date'] = df_hist['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        
+        history_list = df_hist.to_dict('records')
+        
+        return jsonify({
+            'sales': history_list,
+            'total_amount': total_amount,
+            'total_quantity': total_quantity
+        })
     except Exception as e:
         print(f"Error reading history: {e}")
         return jsonify({
@@ -308,7 +504,13 @@ def get_history():
             'total_quantity': 0
         }), 500
 
+@app.route('/api/lan/status', methods=['GET'])
+def get_lan_status():
+    """Get multi-terminal mode, authority reachability and queued operations"""
+    return jsonify(lan_sync.get_status())
+
 @app.route('/api/sync/status', methods=['GET'])
+@lan_sync.forwarded()
 def get_sync_status():
     """Get current sync status"""
     try:
@@ -322,14 +524,17 @@ def get_sync_status():
         })
 
 @app.route('/api/sync/now', methods=['POST'])
+@lan_sync.forwarded()
 def trigger_sync():
     """Manually trigger cloud sync"""
+    if lan_sync.is_terminal():
+        return jsonify(TERMINAL_CLOUD_MESSAGE), 503
     try:
         result = cloud_sync.sync_to_cloud(
             SPREADSHEET_ID,
             SERVICE_ACCOUNT_FILE,
             STOCK_FILE,
-            HISTORIQUE_FILE
+            HISTORY_DIR
         )
         return jsonify(result)
     except Exception as e:
@@ -339,14 +544,17 @@ def trigger_sync():
         }), 500
 
 @app.route('/api/sync/restore', methods=['POST'])
+@lan_sync.forwarded()
 def trigger_restore():
     """Manually trigger restore from cloud"""
+    if lan_sync.is_terminal():
+        return jsonify(TERMINAL_CLOUD_MESSAGE), 503
     try:
         result = cloud_sync.restore_from_cloud(
             SPREADSHEET_ID,
             SERVICE_ACCOUNT_FILE,
             STOCK_FILE,
-            HISTORIQUE_FILE
+            HISTORY_DIR
         )
         if result['success']:
             return jsonify(result)
@@ -365,15 +573,23 @@ if __name__ == '__main__':
     # Initialize Excel files
     init_excel_files()
     
+    # Terminals replay operations queued while the authority was unreachable
+    if lan_sync.is_terminal():
+        print(f"🖧 Mode terminal - serveur principal: {config.AUTHORITY_URL}")
+        lan_sync.start_replay_worker(on_drained=refresh_stock_mirror)
+    elif config.TERMINAL_MODE == 'authority':
+        print(f"🖧 Mode serveur principal - écoute sur {config.HOST}:{config.PORT}")
+    
     # URL to open
-    url = "http://127.0.0.1:5000"
+    url = f"http://127.0.0.1:{config.PORT}"
     
     # Function to open browser
     def open_browser():
         webbrowser.open_new(url)
 
     # Start a timer to open the browser after 1.5 seconds (gives server time to start)
-    Timer(1.5, open_browser).start()
+    if config.OPEN_BROWSER:
+        Timer(1.5, open_browser).start()
     
     # Run the Flask app (debug must be False for windowed mode)
-    app.run(debug=False, host='127.0.0.1', port=5000)
+    app.run(debug=False, host=config.HOST, port=config.PORT)
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Benchmark of the reorder engine on a synthetic catalog and sales history
+Usage: python benchmark_reorder.py [nombre_articles] [nombre_ventes] [ventes_sur_disque]
+
+The in-memory figures time the computation alone; the cold start figures
+read a real partitioned history from disk, with and without its daily
+totals files (the second case happens once, on the first start after an
+update or when the files were deleted).
+"""
+
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import history_store
+import reorder
+import sales_stats
+import stock_store
+
+
+def timed(func):
+    """Run func once and return (result, milliseconds)"""
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def synthetic_sales(rng, names, n_sales, today):
+    """Sales spread over the smoothing horizon, a few articles selling most"""
+    dates = today - pd.to_timedelta(rng.integers(0, sales_stats.HORIZON_DAYS * 86400, n_sales), unit='s')
+    quantities = rng.integers(1, 10, n_sales)
+    return pd.DataFrame({
+        'date': dates,
+        'nom_article': names[rng.zipf(1.5, n_sales) % len(names)],
+        'quantite': quantities,
+        'prix_total': quantities * 100.0,
+    })
+
+
+def run(n_articles, n_sales, n_disk_sales):
+    print(f"--- Benchmark réapprovisionnement: {n_articles} articles x {n_sales} ventes ---")
+    rng = np.random.default_rng(42)
+    names = np.array([f'Article {i}' for i in range(n_articles)], dtype=object)
+    df_stock = stock_store.to_typed(pd.DataFrame({
+        'id': np.arange(1, n_articles + 1),
+        'nom_article': names,
+        'stock': rng.integers(0, 500, n_articles),
+        'prix': rng.integers(10, 50000, n_articles),
+        'min_stock': rng.integers(0, 50, n_articles),
+    }))
+    today = pd.Timestamp.now().normalize()
+
+    sales = synthetic_sales(rng, names, n_sales, today)
+    velocity, velocity_ms = timed(lambda: sales_stats.compute_velocity(
+        sales['date'].to_numpy(), sales['nom_article'].to_numpy(), sales['quantite'].to_numpy(), today))
+    suggestions, suggest_ms = timed(lambda: reorder.suggest(df_stock, velocity))
+    print(f"Vélocité en mémoire (calcul seul):  {velocity_ms:8.1f} ms")
+    print(f"Suggestions de commande:            {suggest_ms:8.1f} ms")
+    print(f"Articles à commander:               {int(suggestions['needs_reorder'].sum())}")
+
+    print(f"--- Démarrage à froid: historique de {n_disk_sales} ventes sur disque ---")
+    with tempfile.TemporaryDirectory() as history_dir:
+        _, write_ms = timed(lambda: history_store.write_history(
+            history_dir, synthetic_sales(rng, names, n_disk_sales, today)))
+        print(f"Écriture de l'historique (une fois): {write_ms / 1000:7.1f} s")
+
+        sales_stats._state['snapshot'] = None
+        _, stats_ms = timed(lambda: sales_stats.get(history_dir))
+        print(f"Avec les totaux journaliers:        {stats_ms:8.1f} ms")
+
+        for name in os.listdir(history_dir):
+            if name.endswith('.stats.npz'):
+                os.remove(os.path.join(history_dir, name))
+        sales_stats._state['snapshot'] = None
+        _, excel_ms = timed(lambda: sales_stats.get(history_dir))
+        print(f"Sans les totaux (relecture Excel):  {excel_ms / 1000:7.1f} s (une seule fois, ventes non bloquées)")
+
+        def sale():
+            version = history_store.append_sale(history_dir, names[0], 1, 100.0)
+            sales_stats.record_sale(names[0], 1, 100.0, version)
+        _, sale_ms = timed(sale)
+        _, record_ms = timed(lambda: sales_stats.record_sale(names[0], 1, 100.0, (n_disk_sales + 2, 1)))
+        print(f"Vente (partition du mois + totaux): {sale_ms:8.1f} ms, dont cache {record_ms:.2f} ms")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 200_000)
@@ -0,0 +1,65 @@
+"""
+Benchmark of the inventory reports on a synthetic catalog and sales history
+Usage: python benchmark_reports.py [nombre_articles] [nombre_ventes]
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+import reports
+import sales_stats
+import stock_store
+
+
+def timed(func):
+    """Run func once and return (result, milliseconds)"""
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run(n_articles, n_sales):
+    print(f"--- Benchmark rapports: {n_articles} articles x {n_sales} ventes ---")
+    rng = np.random.default_rng(42)
+    names = np.array([f'Article {i}' for i in range(n_articles)], dtype=object)
+    df_stock = stock_store.to_typed(pd.DataFrame({
+        'id': np.arange(1, n_articles + 1),
+        'nom_article': names,
+        'stock': rng.integers(0, 500, n_articles),
+        'prix': rng.integers(10, 50000, n_articles),
+        'min_stock': rng.integers(0, 50, n_articles),
+    }))
+
+    today = pd.Timestamp.now().normalize()
+    dates = today - pd.to_timedelta(rng.integers(0, 365 * 86400, n_sales), unit='s')
+    sale_names = names[rng.zipf(1.5, n_sales) % n_articles]
+    quantities = rng.integers(1, 10, n_sales)
+    amounts = quantities * df_stock['prix'].to_numpy()[rng.integers(0, n_articles, n_sales)]
+
+    sales, aggregate_ms = timed(lambda: sales_stats.aggregate_sales(
+        dates.to_numpy(), sale_names, quantities, amounts))
+    print(f"Agrégation de l'historique:  {aggregate_ms:8.1f} ms (une fois, puis incrémentale)")
+
+    # A sale replaces the totals with a new frame sharing the same index
+    after_sale = sales_stats._add_to_totals(sales, sale_names[0], 1, 100.0, today.to_datetime64())
+    for name, build in [
+        ('valuation', lambda totals: reports.valuation(df_stock)),
+        ('dead-stock', lambda totals: reports.dead_stock(df_stock, totals)),
+        ('abc', lambda totals: reports.abc(df_stock, totals)),
+    ]:
+        _, first_ms = timed(lambda: build(sales))
+        # After a sale the memo is invalidated but the name lookup is reused
+        payload, compute_ms = timed(lambda: build(after_sale))
+        body, encode_ms = timed(lambda: stock_store.dumps(payload))
+        print(f"/api/reports/{name:<11} 1er calcul {first_ms:6.1f} ms, après une vente {compute_ms:6.1f} ms, "
+              f"encodage {encode_ms:5.1f} ms, {len(body) / 1e3:5.1f} kB (puis en cache)")
+
+    report = reports.abc(df_stock, sales)
+    print("Classes ABC: " + ", ".join(
+        f"{label} = {c['articles']} articles ({c['share']:.0%} du CA)" for label, c in report['classes'].items()))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000)
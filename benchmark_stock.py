@@ -0,0 +1,75 @@
+"""
+Benchmark of the typed stock table against the frame read_excel returns
+Usage: python benchmark_stock.py [nombre_articles]
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import stock_store
+
+
+def build_catalog(n):
+    """Write a catalog to stock.xlsx and read it back the way the app used to"""
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'nom_article': [f'Article {i % (n // 4 or 1)}' for i in range(n)],
+        'stock': rng.integers(0, 500, n),
+        'prix': rng.integers(10, 50000, n),
+        'min_stock': rng.integers(0, 50, n),
+    })
+    with tempfile.TemporaryDirectory() as tmp:
+        stock_file = os.path.join(tmp, 'stock.xlsx')
+        df.to_excel(stock_file, index=False)
+        return pd.read_excel(stock_file)
+
+
+def timed(func, repeat=20):
+    """Return the best run time of func in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(n):
+    print(f"--- Benchmark stock: {n} articles ---")
+    df_raw = build_catalog(n)
+    df_typed = stock_store.to_typed(df_raw)
+    ids = np.random.default_rng(0).integers(1, n + 1, 1000)
+
+    mem_raw = df_raw.memory_usage(deep=True).sum() / 1e6
+    mem_typed = df_typed.memory_usage(deep=True).sum() / 1e6
+    print(f"Mémoire:        {mem_raw:8.1f} MB -> {mem_typed:8.1f} MB")
+
+    def lookup_scan():
+        for item_id in ids:
+            idx = df_raw[df_raw['id'] == item_id].index
+            int(df_raw.loc[idx[0], 'stock'])
+
+    def lookup_index():
+        for item_id in ids:
+            int(df_typed.at[item_id, 'stock'])
+
+    scan_ms = timed(lookup_scan, repeat=1) / len(ids)
+    index_ms = timed(lookup_index, repeat=3) / len(ids)
+    print(f"Recherche id:   {scan_ms:8.3f} ms -> {index_ms:8.4f} ms")
+
+    raw_ms = timed(lambda: json.dumps(df_raw.to_dict('records')), repeat=3)
+    typed_ms = timed(lambda: stock_store.dumps(stock_store.records(df_typed)), repeat=3)
+    print(f"Sérialisation:  {raw_ms:8.1f} ms -> {typed_ms:8.1f} ms (puis en cache)")
+
+    body = stock_store.dumps(stock_store.records(df_typed))
+    print(f"Taille /api/stock: {len(body) / 1e6:.1f} MB -> {len(gzip.compress(body, 5)) / 1e6:.1f} MB gzip")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -4,11 +4,32 @@ Handles syncing local Excel files with Google Sheets
 """
 
 import socket
+import json
+import random
+import threading
+import time
+from collections import deque
 import gspread
 from google.oauth2.service_account import Credentials
 import pandas as pd
 import os
 from datetime import datetime
+import history_store
+
+# Google Sheets API limits (per user, per project)
+MAX_REQUESTS_PER_MINUTE = 60
+MAX_PAYLOAD_BYTES = 2_000_000  # Recommended maximum request body size
+
+# Retry policy for throttled (429) and server (5xx) errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 64.0
+
+# Sliding one-minute window of request times, shared by every scheduler since
+# the quota is per project: a manual sync and the auto-sync count together
+_request_times = deque()
+_quota_lock = threading.Lock()
 
 # Global variable to track sync status
 _sync_status = {
@@ -63,15 +84,170 @@ def get_google_sheets_client(service_account_file):
         return None
 
 
-def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_file):
+class SheetsRequestScheduler:
+    """
+    Quota-aware scheduler for Google Sheets API calls
+
+    Writes are queued with clear() and write(), then sent by flush() as
+    the fewest possible batch calls: one batch_update to grow the grids,
+    one values_batch_clear and as many values_batch_update calls as the
+    payload limit requires. Every call, opening the spreadsheet included,
+    waits for the per-minute quota shared by all schedulers and is retried
+    on 429/5xx with jittered exponential backoff.
+    """
+
+    def __init__(self, spreadsheet=None, requests_per_minute=None, max_payload_bytes=None,
+                 max_retries=None, clock=time.monotonic, sleep=time.sleep):
+        # Limits default to the module settings at construction time
+        self.spreadsheet = spreadsheet
+        self.requests_per_minute = requests_per_minute or MAX_REQUESTS_PER_MINUTE
+        self.max_payload_bytes = max_payload_bytes or MAX_PAYLOAD_BYTES
+        # Keep a margin for the JSON envelope around the values
+        self._payload_budget = int(self.max_payload_bytes * 0.9)
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self._clock = clock
+        self._sleep = sleep
+        self._clears = []
+        self._writes = []
+        self._grid_rows = {}
+        self.request_count = 0
+        self.retry_count = 0
+
+    @staticmethod
+    def _a1(title, row=None):
+        """A1 notation of a whole worksheet or of the row it starts at"""
+        quoted = "'" + title.replace("'", "''") + "'"
+        return quoted if row is None else f"{quoted}!A{row}"
+
+    def _wait_for_quota(self):
+        """Block until a request fits in the shared sliding one-minute window"""
+        while True:
+            with _quota_lock:
+                now = self._clock()
+                while _request_times and now - _request_times[0] >= 60:
+                    _request_times.popleft()
+                if len(_request_times) < self.requests_per_minute:
+                    _request_times.append(now)
+                    return
+                delay = 60 - (now - _request_times[0])
+            self._sleep(delay)
+
+    def _backoff_delay(self, attempt, error):
+        """Retry-After when the API sends one, otherwise jittered exponential backoff"""
+        retry_after = getattr(getattr(error, 'response', None), 'headers', {}).get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def execute(self, func, *args, **kwargs):
+        """
+        Run one API call under the quota, retrying throttled and server errors
+
+        Raises:
+            gspread.exceptions.APIError once retries are exhausted or the
+            error is not retryable
+        """
+        attempt = 0
+        while True:
+            self._wait_for_quota()
+            self.request_count += 1
+            try:
+                return func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                if e.code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                print(f"⏳ Google Sheets {e.code} - nouvel essai dans {delay:.1f}s")
+                self.retry_count += 1
+                attempt += 1
+                self._sleep(delay)
+
+    def open(self, client, spreadsheet_id):
+        """Open the spreadsheet through the quota and retry policy"""
+        self.spreadsheet = self.execute(client.open_by_key, spreadsheet_id)
+        return self.spreadsheet
+
+    def clear(self, worksheet):
+        """Queue clearing all values of a worksheet"""
+        self._clears.append(self._a1(worksheet.title))
+
+    def write(self, worksheet, start_row, rows):
+        """
+        Queue writing rows starting at start_row (1-based)
+
+        Rows are split into ranges that each stay under the payload limit.
+        """
+        if not rows:
+            return
+        needed_rows = start_row + len(rows) - 1
+        current = self._grid_rows.get(worksheet.id, (worksheet, worksheet.row_count))[1]
+        self._grid_rows[worksheet.id] = (worksheet, max(current, needed_rows))
+
+        chunk, chunk_bytes, chunk_start = [], 0, start_row
+        for row in rows:
+            row_bytes = len(json.dumps(row, ensure_ascii=False, default=str)) + 1
+            if chunk and chunk_bytes + row_bytes > self._payload_budget:
+                self._writes.append((self._a1(worksheet.title, chunk_start), chunk, chunk_bytes))
+                chunk_start += len(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(row)
+            chunk_bytes += row_bytes
+        self._writes.append((self._a1(worksheet.title, chunk_start), chunk, chunk_bytes))
+
+    def flush(self):
+        """Send every queued operation as batched API calls"""
+        resize_requests = [
+            {'updateSheetProperties': {
+                'properties': {'sheetId': worksheet.id, 'gridProperties': {'rowCount': rows}},
+                'fields': 'gridProperties.rowCount'
+            }}
+            for worksheet, rows in self._grid_rows.values() if rows > worksheet.row_count
+        ]
+        if resize_requests:
+            self.execute(self.spreadsheet.batch_update, {'requests': resize_requests})
+
+        if self._clears:
+            self.execute(self.spreadsheet.values_batch_clear, body={'ranges': self._clears})
+
+        # Pack ranges into values_batch_update calls under the payload limit
+        batch, batch_bytes = [], 0
+        for range_name, values, size in self._writes:
+            if batch and batch_bytes + size > self._payload_budget:
+                self._send_values(batch)
+                batch, batch_bytes = [], 0
+            batch.append({'range': range_name, 'values': values})
+            batch_bytes += size
+        if batch:
+            self._send_values(batch)
+
+        self._clears, self._writes, self._grid_rows = [], [], {}
+
+    def _send_values(self, data):
+        self.execute(self.spreadsheet.values_batch_update, {
+            'valueInputOption': 'RAW',
+            'data': data
+        })
+
+
+def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, history_dir, client=None):
     """
     Sync local Excel files to Google Sheets
     
+    The stock sheet is rewritten; the history sheet only receives the rows
+    the partition manifest has not marked as synced yet. All writes go
+    through a SheetsRequestScheduler.
+    
     Args:
         spreadsheet_id: Google Spreadsheet ID
         service_account_file: Path to service account JSON
         stock_file: Path to stock.xlsx
-        historique_file: Path to historique.xlsx
+        history_dir: Path to the partitioned history directory
+        client: Optional already authenticated client (skips the
+            connection check and authentication, e.g. a fake_sheets client)
         
     Returns:
         dict with 'success', 'message' keys
@@ -84,7 +260,7 @@ def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_f
     
     try:
         # Check internet connection
-        if not check_internet_connection():
+        if client is None and not check_internet_connection():
             _sync_status['status'] = 'offline'
             _sync_status['message'] = 'Pas de connexion Internet'
             return {
@@ -101,17 +277,19 @@ def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_f
                 'message': 'Fichier stock.xlsx introuvable'
             }
         
-        if not os.path.exists(historique_file):
+        if not history_store.exists(history_dir):
             _sync_status['status'] = 'online'
-            _sync_status['message'] = 'Fichier historique.xlsx introuvable'
+            _sync_status['message'] = 'Historique introuvable'
             return {
                 'success': False,
-                'message': 'Fichier historique.xlsx introuvable'
+                'message': 'Historique introuvable'
             }
         
-        # Read local Excel files
+        # Read local stock; history partitions are read only when needed
         df_stock = pd.read_excel(stock_file)
-        df_historique = pd.read_excel(historique_file)
+        manifest = history_store.load_manifest(history_dir)
+        partitions = manifest['partitions']
+        row_counts = {key: entry['rows'] for key, entry in partitions.items()}
         
         # Safety check: Don't sync empty data
         if len(df_stock) == 0:
@@ -123,7 +301,8 @@ def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_f
             }
         
         # Get Google Sheets client
-        client = get_google_sheets_client(service_account_file)
+        if client is None:
+            client = get_google_sheets_client(service_account_file)
         if not client:
             _sync_status['status'] = 'online'
             _sync_status['message'] = 'Erreur d\'authentification Google'
@@ -133,14 +312,15 @@ def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_f
             }
         
         # Open the spreadsheet with better error handling
+        scheduler = SheetsRequestScheduler()
         try:
             print(f"🔍 Tentative d'ouverture du spreadsheet: {spreadsheet_id}")
-            spreadsheet = client.open_by_key(spreadsheet_id)
+            spreadsheet = scheduler.open(client, spreadsheet_id)
             print(f"✅ Spreadsheet ouvert: {spreadsheet.title}")
         except gspread.exceptions.APIError as e:
             error_msg = str(e)
             print(f"❌ Erreur API: {error_msg}")
-            if "404" in error_msg or "NOT_FOUND" in error_msg:
+            if e.code == 404:
                 detailed_msg = "❌ Spreadsheet introuvable!\n\nVérifiez que:\n1. L'ID est correct dans config.py\n2. Le spreadsheet est partagé avec:\n   med-orange@med-orange.iam.gserviceaccount.com\n3. Les droits 'Éditeur' sont donnés"
                 _sync_status['status'] = 'online'
                 _sync_status['message'] = detailed_msg
@@ -164,29 +344,61 @@ def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_f
                 'message': error_msg
             }
         
+        # Fetch all worksheets in a single metadata call
+        worksheets = {ws.title: ws for ws in scheduler.execute(spreadsheet.worksheets)}
+        
         # Sync stock data
-        try:
-            # Try to get existing "stock" worksheet
-            stock_worksheet = spreadsheet.worksheet("stock")
-        except gspread.exceptions.WorksheetNotFound:
+        stock_worksheet = worksheets.get("stock")
+        if stock_worksheet is None:
             # Create new worksheet if it doesn't exist
-            stock_worksheet = spreadsheet.add_worksheet(title="stock", rows=1000, cols=10)
+            stock_worksheet = scheduler.execute(spreadsheet.add_worksheet, title="stock", rows=1000, cols=10)
         
         # Clear existing data and update
-        stock_worksheet.clear()
-        stock_worksheet.update([df_stock.columns.values.tolist()] + df_stock.values.tolist())
+        scheduler.clear(stock_worksheet)
+        # Empty cells of stock.xlsx stay empty (NaN is not valid JSON)
+        stock_values = df_stock.astype(object).where(df_stock.notna(), '').values.tolist()
+        scheduler.write(stock_worksheet, 1, [df_stock.columns.values.tolist()] + stock_values)
         
         # Sync historique data
-        try:
-            # Try to get existing "historique" worksheet
-            historique_worksheet = spreadsheet.worksheet("historique")
-        except gspread.exceptions.WorksheetNotFound:
+        history_columns = history_store.HISTORY_COLUMNS
+        historique_worksheet = worksheets.get("historique")
+        if historique_worksheet is not None:
+            header = scheduler.execute(historique_worksheet.row_values, 1)
+        else:
             # Create new worksheet if it doesn't exist
-            historique_worksheet = spreadsheet.add_worksheet(title="historique", rows=1000, cols=10)
+            historique_worksheet = scheduler.execute(spreadsheet.add_worksheet, title="historique", rows=1000, cols=10)
+            header = []
         
-        # Clear existing data and update
-        historique_worksheet.clear()
-        historique_worksheet.update([df_historique.columns.values.tolist()] + df_historique.values.tolist())
+        # Append only the unsynced tail of each partition when the sheet is intact
+        # and its length is known, otherwise rewrite the whole history. The sheet
+        # can hold rows the local history dropped (e.g. unparseable dates on
+        # restore), so its own row count - not the synced rows - locates the end.
+        previously_synced = any(entry.get('synced_rows', 0) for entry in partitions.values())
+        cloud_rows = manifest.get('cloud_rows')
+        append_only = header == history_columns and previously_synced and cloud_rows is not None
+        
+        if append_only:
+            new_rows = []
+            for key in sorted(partitions):
+                entry = partitions[key]
+                synced_rows = entry.get('synced_rows', 0)
+                if synced_rows >= row_counts[key]:
+                    continue
+                df_part = history_store.read_history(history_dir, keys=[key])
+                df_part['date'] = df_part['date'].dt.strftime(history_store.DATE_FORMAT)
+                new_rows += df_part[history_columns].iloc[synced_rows:row_counts[key]].values.tolist()
+            scheduler.write(historique_worksheet, 2 + cloud_rows, new_rows)
+            cloud_rows += len(new_rows)
+        else:
+            df_historique = history_store.read_history(history_dir)
+            df_historique['date'] = df_historique['date'].dt.strftime(history_store.DATE_FORMAT)
+            df_historique = df_historique[history_columns]
+            scheduler.clear(historique_worksheet)
+            scheduler.write(historique_worksheet, 1, [history_columns] + df_historique.values.tolist())
+            cloud_rows = len(df_historique)
+        
+        scheduler.flush()
+        history_store.mark_synced(history_dir, row_counts, cloud_rows)
         
         # Update sync status
         _sync_status['status'] = 'online'
@@ -195,9 +407,21 @@ def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_f
         
         return {
             'success': True,
-            'message': f'✅ Synchronisation réussie! ({len(df_stock)} articles, {len(df_historique)} ventes)'
+            'message': f'✅ Synchronisation réussie! ({len(df_stock)} articles, {sum(row_counts.values())} ventes)'
         }
         
+    except gspread.exceptions.APIError as e:
+        print(f"❌ Error syncing to cloud: {e}")
+        if e.code == 429:
+            error_msg = 'Quota Google Sheets dépassé - réessayez dans une minute'
+        else:
+            error_msg = f'Erreur API Google Sheets: {str(e)}'
+        _sync_status['status'] = 'online'
+        _sync_status['message'] = error_msg
+        return {
+            'success': False,
+            'message': error_msg
+        }
     except Exception as e:
         print(f"❌ Error syncing to cloud: {e}")
         print(f"❌ Error type: {type(e).__name__}")
@@ -209,7 +433,7 @@ def sync_to_cloud(spreadsheet_id, service_account_file, stock_file, historique_f
         }
 
 
-def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, historique_file):
+def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, history_dir, client=None):
     """
     Restore local Excel files from Google Sheets
     
@@ -217,7 +441,8 @@ def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, histori
         spreadsheet_id: Google Spreadsheet ID
         service_account_file: Path to service account JSON
         stock_file: Path to stock.xlsx
-        historique_file: Path to historique.xlsx
+        history_dir: Path to the partitioned history directory
+        client: Optional already authenticated client
         
     Returns:
         dict with 'success', 'message' keys
@@ -226,7 +451,7 @@ def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, histori
     
     try:
         # Check internet connection
-        if not check_internet_connection():
+        if client is None and not check_internet_connection():
             _sync_status['status'] = 'offline'
             _sync_status['message'] = 'Pas de connexion Internet'
             return {
@@ -235,7 +460,8 @@ def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, histori
             }
         
         # Get Google Sheets client
-        client = get_google_sheets_client(service_account_file)
+        if client is None:
+            client = get_google_sheets_client(service_account_file)
         if not client:
             return {
                 'success': False,
@@ -243,12 +469,13 @@ def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, histori
             }
         
         # Open the spreadsheet
-        spreadsheet = client.open_by_key(spreadsheet_id)
+        scheduler = SheetsRequestScheduler()
+        spreadsheet = scheduler.open(client, spreadsheet_id)
         
         # Restore stock data
         try:
-            stock_worksheet = spreadsheet.worksheet("stock")
-            stock_data = stock_worksheet.get_all_values()
+            stock_worksheet = scheduler.execute(spreadsheet.worksheet, "stock")
+            stock_data = scheduler.execute(stock_worksheet.get_all_values)
             
             if len(stock_data) > 1:  # Has data beyond header
                 df_stock = pd.DataFrame(stock_data[1:], columns=stock_data[0])
@@ -281,8 +508,8 @@ def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, histori
         
         # Restore historique data
         try:
-            historique_worksheet = spreadsheet.worksheet("historique")
-            historique_data = historique_worksheet.get_all_values()
+            historique_worksheet = scheduler.execute(spreadsheet.worksheet, "historique")
+            historique_data = scheduler.execute(historique_worksheet.get_all_values)
             
             if len(historique_data) > 1:  # Has data beyond header
                 df_historique = pd.DataFrame(historique_data[1:], columns=historique_data[0])
@@ -293,16 +520,19 @@ def restore_from_cloud(spreadsheet_id, service_account_file, stock_file, histori
                 if 'prix_total' in df_historique.columns:
                     df_historique['prix_total'] = pd.to_numeric(df_historique['prix_total'], errors='coerce')
                 
-                # Save to Excel
-                df_historique.to_excel(historique_file, index=False)
+                # Split into monthly partitions, already in sync with the cloud. Rows
+                # with an unparseable date are not restored but still occupy the sheet.
+                written = history_store.write_history(history_dir, df_historique, synced=True,
+                                                      cloud_rows=len(df_historique))
+                if written < len(df_historique):
+                    print(f"⚠️ {len(df_historique) - written} vente(s) du cloud sans date valide non restaurée(s)")
             else:
                 # Create empty historique if none exists
-                df_historique = pd.DataFrame(columns=['date', 'nom_article', 'quantite', 'prix_total'])
-                df_historique.to_excel(historique_file, index=False)
+                history_store.write_history(history_dir, history_store.empty_history(), synced=True,
+                                            cloud_rows=0)
         except gspread.exceptions.WorksheetNotFound:
             # Create empty historique if worksheet doesn't exist
-            df_historique = pd.DataFrame(columns=['date', 'nom_article', 'quantite', 'prix_total'])
-            df_historique.to_excel(historique_file, index=False)
+            history_store.write_history(history_dir, history_store.empty_history())
         
         # Update sync status
         _sync_status['status'] = 'restored'
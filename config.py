@@ -16,3 +16,16 @@ SPREADSHEET_ID = "1ACmdCigZ8uNGOOgqRfg52AzbhsCd2wbTGngxDyqh2EU"
 
 # Service Account Credentials File (EXTERNAL to the exe)
 SERVICE_ACCOUNT_FILE = os.path.join(BASE_PATH, "med-orange.json")
+
+# Multi-terminal LAN mode (environment variables override these values)
+# - 'standalone': a single checkout PC (default)
+# - 'authority': this PC holds the stock; other terminals connect to it over the LAN
+# - 'terminal': sales and stock changes are forwarded to AUTHORITY_URL and
+#   queued locally while it is unreachable
+TERMINAL_MODE = os.environ.get('STOCK_TERMINAL_MODE', 'standalone')
+AUTHORITY_URL = os.environ.get('STOCK_AUTHORITY_URL', 'http://192.168.1.10:5000')
+
+# Web server (the authority must listen on the LAN, not only on 127.0.0.1)
+HOST = os.environ.get('STOCK_HOST', '0.0.0.0' if TERMINAL_MODE == 'authority' else '127.0.0.1')
+PORT = int(os.environ.get('STOCK_PORT', '5000'))
+OPEN_BROWSER = os.environ.get('STOCK_OPEN_BROWSER', '1') == '1'
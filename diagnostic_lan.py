@@ -0,0 +1,182 @@
+"""
+Diagnostic of the multi-terminal LAN mode
+Starts an authority and two terminals on localhost (separate processes and
+data folders), sells through both terminals, stops the authority, sells
+offline, restarts it and checks every queued operation was replayed once.
+Then replays queues that are cut off between an offline creation and the
+sale using its id, and whose creation is refused.
+
+Usage: python diagnostic_lan.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+import pandas as pd
+import config
+import history_store
+import lan_sync
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+AUTHORITY_PORT = 5101
+TERMINAL_PORTS = [5102, 5103]
+
+
+def call(port, method, path, body=None, headers=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(f'http://127.0.0.1:{port}{path}', data=data, method=method,
+                                 headers={'Content-Type': 'application/json', **(headers or {})})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def prepare_data(folder):
+    os.makedirs(os.path.join(folder, 'data'), exist_ok=True)
+    pd.DataFrame([
+        {'id': 1, 'nom_article': 'Laptop Dell', 'stock': 15, 'prix': 45000, 'min_stock': 5},
+        {'id': 2, 'nom_article': 'Souris Logitech', 'stock': 30, 'prix': 1500, 'min_stock': 10},
+    ]).to_excel(os.path.join(folder, 'data', 'stock.xlsx'), index=False)
+    history_store.init_history(os.path.join(folder, 'data', 'historique'))
+
+
+def start(folder, port, mode):
+    env = dict(os.environ, STOCK_TERMINAL_MODE=mode, STOCK_PORT=str(port), STOCK_HOST='127.0.0.1',
+               STOCK_AUTHORITY_URL=f'http://127.0.0.1:{AUTHORITY_PORT}', STOCK_OPEN_BROWSER='0')
+    process = subprocess.Popen([sys.executable, APP_FILE], cwd=folder, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            call(port, 'GET', '/api/lan/status')
+            return process
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Le serveur {mode} ne démarre pas sur le port {port}')
+
+
+def stock_of(port, item_id):
+    return next(item['stock'] for item in call(port, 'GET', '/api/stock')[1] if item['id'] == item_id)
+
+
+def check(label, condition):
+    print(f"[{'SUCCESS' if condition else 'ERROR'}] {label}")
+    return condition
+
+
+def check_interrupted_replay(folder):
+    """
+    Replay an outbox in-process against the running authority
+
+    Local ids are chosen to collide with existing authority articles, so a
+    sale sent with its local id would hit the wrong article.
+    """
+    ok = True
+    config.AUTHORITY_URL = f'http://127.0.0.1:{AUTHORITY_PORT}'
+    lan_sync.OUTBOX_FILE = os.path.join(folder, 'outbox.json')
+    forward = lan_sync.forward
+    before = {item['nom_article']: item['stock'] for item in call(AUTHORITY_PORT, 'GET', '/api/stock')[1]}
+
+    # The authority goes down right after the creation was replayed
+    lan_sync.enqueue('POST', '/api/stock', {'nom_article': 'Ecran', 'stock': 5, 'prix': 20000, 'min_stock': 1},
+                     str(uuid.uuid4()), local_id=3)
+    lan_sync.enqueue('POST', '/api/vente', {'article_id': 3, 'quantite': 2}, str(uuid.uuid4()))
+    sent = []
+
+    def forward_then_fail(*args, **kwargs):
+        if sent:
+            raise lan_sync.AuthorityUnreachable('arrêt simulé')
+        sent.append(args)
+        return forward(*args, **kwargs)
+
+    lan_sync.forward = forward_then_fail
+    try:
+        remaining = lan_sync.replay_pending()
+    finally:
+        lan_sync.forward = forward
+    ok &= check("Rejeu interrompu après la création", remaining == 1)
+    ok &= check("Rejeu repris sur un nouveau passage", lan_sync.replay_pending() == 0)
+    stock = {item['nom_article']: item['stock'] for item in call(AUTHORITY_PORT, 'GET', '/api/stock')[1]}
+    ok &= check("Vente rejouée sur l'article créé hors ligne, pas sur l'id local",
+                stock.get('Ecran') == 3 and stock.get('Clavier') == before.get('Clavier'))
+
+    # The authority refuses the creation: the sale of that article must not be sent
+    lan_sync.enqueue('POST', '/api/stock', {'nom_article': 'Webcam', 'stock': 'beaucoup', 'prix': 5000, 'min_stock': 1},
+                     str(uuid.uuid4()), local_id=1)
+    lan_sync.enqueue('POST', '/api/vente', {'article_id': 1, 'quantite': 1}, str(uuid.uuid4()))
+    lan_sync.replay_pending()
+    stock = {item['nom_article']: item['stock'] for item in call(AUTHORITY_PORT, 'GET', '/api/stock')[1]}
+    outbox = lan_sync.load_outbox()
+    ok &= check("Opérations dépendant d'une création refusée rejetées",
+                len(outbox['rejected']) == 2 and not outbox['pending']
+                and stock.get('Laptop Dell') == before.get('Laptop Dell'))
+    ok &= check("Correspondance des ids oubliée une fois la file vidée", outbox['id_map'] == {})
+    return ok
+
+
+def run():
+    print("--- Diagnostic Mode Multi-Postes ---")
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        folders = {name: os.path.join(tmp, name) for name in ['principal', 'caisse1', 'caisse2']}
+        for folder in folders.values():
+            prepare_data(folder)
+
+        authority = start(folders['principal'], AUTHORITY_PORT, 'authority')
+        terminals = [start(folders[f'caisse{i + 1}'], port, 'terminal') for i, port in enumerate(TERMINAL_PORTS)]
+        try:
+            # Both terminals sell the same article: no sale may be lost
+            call(TERMINAL_PORTS[0], 'POST', '/api/vente', {'article_id': 1, 'quantite': 2})
+            call(TERMINAL_PORTS[1], 'POST', '/api/vente', {'article_id': 1, 'quantite': 3})
+            ok &= check("Ventes des 2 caisses appliquées au serveur principal", stock_of(AUTHORITY_PORT, 1) == 10)
+
+            # The same idempotency key only applies once
+            key = {'Idempotency-Key': str(uuid.uuid4())}
+            call(AUTHORITY_PORT, 'POST', '/api/vente', {'article_id': 2, 'quantite': 1}, key)
+            call(AUTHORITY_PORT, 'POST', '/api/vente', {'article_id': 2, 'quantite': 1}, key)
+            ok &= check("Clé d'idempotence rejouée une seule fois", stock_of(AUTHORITY_PORT, 2) == 29)
+
+            # The UI refreshes the stock after each sale, which updates the terminal's copy
+            call(TERMINAL_PORTS[0], 'GET', '/api/stock')
+
+            # Authority down: the terminal applies locally and queues
+            authority.terminate()
+            authority.wait()
+            _, sale = call(TERMINAL_PORTS[0], 'POST', '/api/vente', {'article_id': 1, 'quantite': 4})
+            _, created = call(TERMINAL_PORTS[0], 'POST', '/api/stock',
+                              {'nom_article': 'Clavier', 'stock': 8, 'prix': 3500, 'min_stock': 2})
+            call(TERMINAL_PORTS[0], 'POST', '/api/vente', {'article_id': created['id'], 'quantite': 1})
+            status = call(TERMINAL_PORTS[0], 'GET', '/api/lan/status')[1]
+            ok &= check("Vente hors ligne mise en file d'attente", sale.get('queued') and status['pending'] == 3)
+            ok &= check("Stock local mis à jour hors ligne", stock_of(TERMINAL_PORTS[0], 1) == 6)
+
+            # Authority back: the queue is replayed in order
+            authority = start(folders['principal'], AUTHORITY_PORT, 'authority')
+            for _ in range(30):
+                if call(TERMINAL_PORTS[0], 'GET', '/api/lan/status')[1]['pending'] == 0:
+                    break
+                time.sleep(0.5)
+            stock = {item['nom_article']: item['stock'] for item in call(AUTHORITY_PORT, 'GET', '/api/stock')[1]}
+            ok &= check("File d'attente rejouée vers le serveur principal",
+                        stock.get('Laptop Dell') == 6 and stock.get('Clavier') == 7)
+            history = call(AUTHORITY_PORT, 'GET', '/api/historique')[1]
+            ok &= check("Historique complet sur le serveur principal", len(history['sales']) == 5)
+
+            ok &= check_interrupted_replay(tmp)
+        finally:
+            for process in [authority] + terminals:
+                process.terminate()
+                process.wait()
+
+    print("[SUCCESS] Mode multi-postes opérationnel" if ok else "[ERROR] Des vérifications ont échoué")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run() else 1)
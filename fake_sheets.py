@@ -0,0 +1,285 @@
+"""
+Fake Google Sheets
+Local in-memory stand-in for the gspread client used by cloud_sync, with
+injectable throttling (429), server errors (5xx), a per-minute quota and
+the request payload limit.
+
+Usage: python fake_sheets.py [nombre_ventes]
+Runs sync_to_cloud against the fake with injected errors and prints the calls,
+checks that a restore followed by a sale appends after the cloud rows, and
+that two schedulers share the per-minute quota.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+import gspread
+import requests
+
+import cloud_sync
+
+_RANGE_RE = re.compile(r"^'((?:[^']|'')*)'(?:!A(\d+))?$")
+
+
+def api_error(code, message, retry_after=None):
+    """Build the gspread APIError the real client raises for an HTTP error"""
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({
+        'error': {'code': code, 'message': message, 'status': 'FAKE'}
+    }).encode('utf-8')
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return gspread.exceptions.APIError(response)
+
+
+def _parse_range(range_name):
+    """Split an A1 range produced by the scheduler into (title, start_row)"""
+    match = _RANGE_RE.match(range_name)
+    if not match:
+        raise api_error(400, f'Unable to parse range: {range_name}')
+    return match.group(1).replace("''", "'"), int(match.group(2) or 1)
+
+
+class FakeWorksheet:
+    """In-memory worksheet exposing the gspread Worksheet calls cloud_sync uses"""
+
+    def __init__(self, spreadsheet, sheet_id, title, rows, cols):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = {}  # 1-based row -> list of cell strings
+
+    def _values(self):
+        last_row = max((row for row, values in self.cells.items() if any(values)), default=0)
+        return [self.cells.get(row, []) for row in range(1, last_row + 1)]
+
+    def row_values(self, row):
+        self.spreadsheet._request('row_values')
+        return list(self.cells.get(row, []))
+
+    def get_all_values(self):
+        self.spreadsheet._request('get_all_values')
+        return [list(values) for values in self._values()]
+
+    def clear(self):
+        self.spreadsheet._request('clear')
+        self.cells = {}
+
+
+class FakeSpreadsheet:
+    """
+    In-memory spreadsheet enforcing the Sheets API constraints cloud_sync relies on
+
+    Args:
+        title: Spreadsheet title
+        requests_per_minute: Quota after which calls fail with 429 (None = unlimited)
+        max_payload_bytes: Request bodies above this fail with 413
+        clock: Time source of the quota window
+    """
+
+    def __init__(self, title='Fake', requests_per_minute=None,
+                 max_payload_bytes=cloud_sync.MAX_PAYLOAD_BYTES, clock=time.monotonic):
+        self.title = title
+        self.requests_per_minute = requests_per_minute
+        self.max_payload_bytes = max_payload_bytes
+        self._clock = clock
+        self._sheets = {}
+        self._next_id = 0
+        self._failures = deque()
+        self._request_times = deque()
+        self.calls = []  # (method, payload bytes) of every request, failed ones included
+
+    def inject_errors(self, *codes, retry_after=None):
+        """Make the next len(codes) requests fail with these HTTP status codes"""
+        for code in codes:
+            self._failures.append((code, retry_after))
+
+    def _request(self, method, body=None):
+        size = len(json.dumps(body, default=str).encode('utf-8')) if body is not None else 0
+        self.calls.append((method, size))
+
+        if self._failures:
+            code, retry_after = self._failures.popleft()
+            raise api_error(code, f'Injected error on {method}', retry_after)
+
+        if self.requests_per_minute is not None:
+            now = self._clock()
+            while self._request_times and now - self._request_times[0] >= 60:
+                self._request_times.popleft()
+            if len(self._request_times) >= self.requests_per_minute:
+                raise api_error(429, 'Quota exceeded for quota metric Write requests per minute')
+            self._request_times.append(now)
+
+        if size > self.max_payload_bytes:
+            raise api_error(413, f'Request payload size exceeds the limit: {self.max_payload_bytes} bytes')
+
+    def worksheets(self):
+        self._request('worksheets')
+        return list(self._sheets.values())
+
+    def worksheet(self, title):
+        self._request('worksheet')
+        if title not in self._sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self._request('add_worksheet')
+        self._next_id += 1
+        self._sheets[title] = FakeWorksheet(self, self._next_id, title, int(rows), int(cols))
+        return self._sheets[title]
+
+    def batch_update(self, body):
+        self._request('batch_update', body)
+        sheets_by_id = {ws.id: ws for ws in self._sheets.values()}
+        for request in body['requests']:
+            properties = request['updateSheetProperties']['properties']
+            sheets_by_id[properties['sheetId']].row_count = properties['gridProperties']['rowCount']
+        return {'replies': [{} for _ in body['requests']]}
+
+    def values_batch_clear(self, params=None, body=None):
+        self._request('values_batch_clear', body)
+        for range_name in body['ranges']:
+            title, _ = _parse_range(range_name)
+            self._sheets[title].cells = {}
+        return {'clearedRanges': body['ranges']}
+
+    def values_batch_update(self, body):
+        self._request('values_batch_update', body)
+        for value_range in body['data']:
+            title, start_row = _parse_range(value_range['range'])
+            worksheet = self._sheets[title]
+            last_row = start_row + len(value_range['values']) - 1
+            if last_row > worksheet.row_count:
+                raise api_error(400, f"Range ('{title}'!A{start_row}) exceeds grid limits. "
+                                     f"Max rows: {worksheet.row_count}")
+            for offset, values in enumerate(value_range['values']):
+                worksheet.cells[start_row + offset] = ['' if v is None else str(v) for v in values]
+        return {'totalUpdatedRows': sum(len(r['values']) for r in body['data'])}
+
+
+class FakeClient:
+    """Stand-in for gspread.Client returning the same fake spreadsheet for any key"""
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        # A real API request (spreadsheet metadata): throttling and errors apply
+        self.spreadsheet._request('open_by_key')
+        return self.spreadsheet
+
+
+def run_demo(n_sales):
+    """Sync a generated history to the fake with throttling and server errors injected"""
+    import tempfile
+    import pandas as pd
+    import history_store
+
+    print(f"--- Synchronisation vers le faux Google Sheets: {n_sales} ventes ---")
+    with tempfile.TemporaryDirectory() as tmp:
+        stock_file = os.path.join(tmp, 'stock.xlsx')
+        history_dir = os.path.join(tmp, 'historique')
+        pd.DataFrame([{'id': 1, 'nom_article': 'Laptop Dell', 'stock': 15, 'prix': 45000, 'min_stock': 5}]) \
+            .to_excel(stock_file, index=False)
+        dates = pd.Timestamp.now() - pd.to_timedelta(range(n_sales), unit='min')
+        history_store.write_history(history_dir, pd.DataFrame({
+            'date': dates, 'nom_article': 'Laptop Dell', 'quantite': 1, 'prix_total': 45000
+        }))
+
+        # Small payload limit so the demo exercises chunking
+        cloud_sync.MAX_PAYLOAD_BYTES = 200_000
+        spreadsheet = FakeSpreadsheet(max_payload_bytes=cloud_sync.MAX_PAYLOAD_BYTES)
+        # The first two requests are the spreadsheet opening
+        spreadsheet.inject_errors(429, 503)
+        result = cloud_sync.sync_to_cloud('fake', None, stock_file, history_dir, client=FakeClient(spreadsheet))
+        print(result['message'])
+        for method, size in spreadsheet.calls:
+            print(f"  {method:<22} {size:>9} octets")
+
+        rows = len(spreadsheet._sheets['historique'].get_all_values()) - 1
+        print(f"Lignes dans la feuille historique: {rows}")
+
+
+def run_restore_append_check():
+    """
+    Restore a sheet holding a row the local history cannot keep, sell, then sync
+
+    The new sale must land after every existing cloud row, not over one.
+    """
+    import tempfile
+    import history_store
+
+    print("--- Restauration puis ajout d'une vente ---")
+    header = history_store.HISTORY_COLUMNS
+    cloud_rows = [
+        ['bad', 'Souris Logitech', '1', '1500'],
+        ['2026-09-02 10:00:00', 'Laptop Dell', '1', '45000'],
+    ]
+    spreadsheet = FakeSpreadsheet()
+    stock_ws = spreadsheet.add_worksheet('stock', 1000, 10)
+    stock_ws.cells = {1: ['id', 'nom_article', 'stock', 'prix', 'min_stock'],
+                      2: ['1', 'Laptop Dell', '15', '45000', '5']}
+    history_ws = spreadsheet.add_worksheet('historique', 1000, 10)
+    history_ws.cells = {row: values for row, values in enumerate([header] + cloud_rows, start=1)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stock_file = os.path.join(tmp, 'stock.xlsx')
+        history_dir = os.path.join(tmp, 'historique')
+        client = FakeClient(spreadsheet)
+        print(cloud_sync.restore_from_cloud('fake', None, stock_file, history_dir, client=client)['message'])
+        history_store.append_sale(history_dir, 'Laptop Dell', 2, 90000, date='2026-09-03 11:00:00')
+        print(cloud_sync.sync_to_cloud('fake', None, stock_file, history_dir, client=client)['message'])
+
+    expected = [header] + cloud_rows + [['2026-09-03 11:00:00', 'Laptop Dell', '2', '90000']]
+    actual = history_ws.get_all_values()
+    for row in actual:
+        print(f"  {row}")
+    if actual != expected:
+        raise SystemExit("❌ La feuille historique a perdu ou écrasé des ventes")
+    print("✅ Aucune vente du cloud écrasée")
+
+
+def run_shared_quota_check():
+    """
+    Run two schedulers (a manual sync during the auto-sync) on a simulated clock
+
+    Together they must stay under the quota: the second one waits for the
+    window the first one filled instead of starting a fresh one.
+    """
+    print("--- Quota partagé entre deux synchronisations ---")
+    clock = {'now': 0.0}
+
+    def sleep(seconds):
+        clock['now'] += seconds
+
+    spreadsheet = FakeSpreadsheet(requests_per_minute=3, clock=lambda: clock['now'])
+    auto_sync, manual_sync = (
+        cloud_sync.SheetsRequestScheduler(spreadsheet, requests_per_minute=3,
+                                          clock=lambda: clock['now'], sleep=sleep)
+        for _ in range(2)
+    )
+    cloud_sync._request_times.clear()
+    try:
+        for scheduler in (auto_sync, manual_sync, auto_sync, manual_sync):
+            scheduler.execute(spreadsheet.worksheets)
+    finally:
+        cloud_sync._request_times.clear()
+
+    print(f"  4 requêtes, {auto_sync.retry_count + manual_sync.retry_count} erreur(s) 429, "
+          f"attente simulée {clock['now']:.0f}s")
+    if auto_sync.retry_count or manual_sync.retry_count:
+        raise SystemExit("❌ Les deux synchronisations ont dépassé le quota ensemble")
+    print("✅ Quota respecté à deux")
+
+
+if __name__ == '__main__':
+    run_demo(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
+    run_restore_append_check()
+    run_shared_quota_check()
@@ -15,6 +15,7 @@ a = Analysis(
         'flask',
         'pandas',
         'openpyxl',
+        'orjson',
         'openpyxl.cell._writer',
         'jinja2',
         'werkzeug',
@@ -0,0 +1,484 @@
+"""
+History Storage Module
+Stores the sales history as monthly Excel partitions with a JSON manifest
+"""
+
+import json
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+
+HISTORY_COLUMNS = ['date', 'nom_article', 'quantite', 'prix_total']
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MANIFEST_FILE = 'manifest.json'
+
+_PARTITION_FILE = re.compile(r'^(\d{4}-\d{2})\.xlsx$')
+
+# Columns of the per-day, per-article totals kept next to each partition
+DAILY_COLUMNS = ['day', 'nom_article', 'quantite', 'prix_total', 'last_sale']
+
+# Serializes partition and manifest writes between request threads
+# (reentrant: load_manifest repairs the manifest from inside write paths)
+_lock = threading.RLock()
+
+
+def empty_history():
+    """Return an empty history DataFrame with the expected columns"""
+    return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+
+def partition_key(date):
+    """
+    Get the partition key (YYYY-MM) for a date
+
+    Args:
+        date: datetime, Timestamp or date string
+
+    Returns:
+        str partition key
+    """
+    return pd.Timestamp(date).strftime('%Y-%m')
+
+
+def partition_path(history_dir, key):
+    """Return the Excel file path of a monthly partition"""
+    return os.path.join(history_dir, f'{key}.xlsx')
+
+
+def stats_path(history_dir, key):
+    """Path of the daily totals file of a partition"""
+    return os.path.join(history_dir, f'{key}.stats.npz')
+
+
+def exists(history_dir):
+    """Check whether a partitioned history has been initialized"""
+    return os.path.exists(os.path.join(history_dir, MANIFEST_FILE))
+
+
+def init_history(history_dir):
+    """Create an empty partitioned history if none exists"""
+    os.makedirs(history_dir, exist_ok=True)
+    if not exists(history_dir):
+        save_manifest(history_dir, {'partitions': {}})
+
+
+def _read_manifest(history_dir):
+    try:
+        with open(os.path.join(history_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'partitions': {}}
+
+
+def _file_signature(path):
+    """(mtime, size) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _changed_partitions(history_dir, manifest):
+    """
+    Keys of the partitions whose file no longer matches the manifest
+
+    Covers files edited, deleted or added outside the application.
+    """
+    on_disk = set()
+    if os.path.isdir(history_dir):
+        on_disk = {match.group(1) for match in map(_PARTITION_FILE.match, os.listdir(history_dir)) if match}
+    changed = on_disk - set(manifest['partitions'])
+    for key, entry in manifest['partitions'].items():
+        signature = _file_signature(partition_path(history_dir, key))
+        # Entries written before signatures were recorded adopt the current file
+        if signature is None or ('size' in entry and [entry['mtime'], entry['size']] != signature):
+            changed.add(key)
+    return sorted(changed)
+
+
+def load_manifest(history_dir):
+    """
+    Load the partition manifest, re-summarizing partitions changed on disk
+
+    Each entry records its file's mtime and size, like stock_store does for
+    stock.xlsx, so a partition edited by hand in Excel is re-read once and
+    its totals and row count stay true. Such a change also bumps
+    'revision', which tells the sales caches to rebuild.
+
+    Returns:
+        dict with a 'partitions' mapping of partition key -> summary
+    """
+    manifest = _read_manifest(history_dir)
+    manifest.setdefault('revision', 0)
+    unsigned = any('size' not in entry for entry in manifest['partitions'].values())
+    if not unsigned and not _changed_partitions(history_dir, manifest):
+        return manifest
+
+    with _lock:
+        # Another thread may have repaired it meanwhile
+        manifest = _read_manifest(history_dir)
+        manifest.setdefault('revision', 0)
+        changed = _changed_partitions(history_dir, manifest)
+        for key in changed:
+            if os.path.exists(partition_path(history_dir, key)):
+                df_part = _read_partition(history_dir, key)
+                manifest['partitions'][key] = _summarize(df_part, manifest['partitions'].get(key))
+                _sign(history_dir, key, manifest['partitions'][key])
+                _write_stats(history_dir, key, df_part)
+                print(f"🔄 Partition d'historique {key} modifiée hors de l'application - totaux recalculés")
+            else:
+                manifest['partitions'].pop(key, None)
+                _remove(stats_path(history_dir, key))
+                print(f"🔄 Partition d'historique {key} supprimée hors de l'application")
+        for key, entry in manifest['partitions'].items():
+            if 'size' not in entry:
+                _sign(history_dir, key, entry)
+        if changed:
+            manifest['revision'] += 1
+        save_manifest(history_dir, manifest)
+        return manifest
+
+
+def save_manifest(history_dir, manifest):
+    """Write the manifest atomically so a crash never leaves it half-written"""
+    path = os.path.join(history_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _summarize(df, previous=None):
+    """Build the manifest entry of a partition DataFrame"""
+    dates = pd.to_datetime(df['date'], errors='coerce', format='mixed')
+    entry = {
+        'rows': int(len(df)),
+        'min_date': dates.min().strftime(DATE_FORMAT) if dates.notna().any() else None,
+        'max_date': dates.max().strftime(DATE_FORMAT) if dates.notna().any() else None,
+        'total_amount': float(pd.to_numeric(df['prix_total'], errors='coerce').sum()),
+        'total_quantity': int(pd.to_numeric(df['quantite'], errors='coerce').sum()),
+    }
+    # Keep the cloud sync watermark across rewrites of the same partition
+    entry['synced_rows'] = min((previous or {}).get('synced_rows', 0), entry['rows'])
+    return entry
+
+
+def _sign(history_dir, key, entry):
+    """Record the partition file's current mtime and size in its manifest entry"""
+    entry['mtime'], entry['size'] = _file_signature(partition_path(history_dir, key))
+    return entry
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def daily_totals(df):
+    """
+    Per-day, per-article totals of a DataFrame of sales
+
+    Returns:
+        DataFrame with DAILY_COLUMNS ('last_sale' is the latest sale of the day)
+    """
+    dates = pd.to_datetime(df['date'], errors='coerce', format='mixed')
+    valid = dates.notna().to_numpy()
+    sales = pd.DataFrame({
+        'day': dates[valid].dt.floor('D'),
+        'nom_article': df['nom_article'][valid].astype(str),
+        'quantite': pd.to_numeric(df['quantite'][valid], errors='coerce').fillna(0).astype('float64'),
+        'prix_total': pd.to_numeric(df['prix_total'][valid], errors='coerce').fillna(0).astype('float64'),
+        'last_sale': dates[valid],
+    })
+    daily = sales.groupby(['day', 'nom_article'], sort=True).agg(
+        quantite=('quantite', 'sum'), prix_total=('prix_total', 'sum'), last_sale=('last_sale', 'max'))
+    return daily.reset_index()[DAILY_COLUMNS]
+
+
+def _write_stats(history_dir, key, df_part, signature=None):
+    """
+    Save the daily totals of a partition next to it
+
+    The file records the partition's (mtime, size) so a later edit of the
+    partition makes it stale. Writing is best effort: a missing file is
+    rebuilt by read_daily_sales.
+
+    Args:
+        signature: Signature of the partition df_part was read from
+            (defaults to the file's current one, right after writing it)
+
+    Returns:
+        The daily totals DataFrame
+    """
+    daily = daily_totals(df_part)
+    path = stats_path(history_dir, key)
+    signature = signature or _file_signature(partition_path(history_dir, key))
+    try:
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f,
+                     day=daily['day'].to_numpy(dtype='datetime64[D]'),
+                     nom_article=daily['nom_article'].to_numpy(dtype=str),
+                     quantite=daily['quantite'].to_numpy(),
+                     prix_total=daily['prix_total'].to_numpy(),
+                     last_sale=daily['last_sale'].to_numpy(dtype='datetime64[ns]'),
+                     signature=np.array(signature or [0, 0], dtype=np.int64))
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"⚠️ Totaux journaliers de {key} non enregistrés: {e}")
+    return daily
+
+
+def _load_stats(history_dir, key):
+    """Daily totals of a partition from its stats file, or None if missing or stale"""
+    try:
+        with np.load(stats_path(history_dir, key)) as data:
+            if data['signature'].tolist() != _file_signature(partition_path(history_dir, key)):
+                return None
+            return pd.DataFrame({
+                'day': data['day'].astype('datetime64[ns]'),
+                'nom_article': data['nom_article'].astype(object),
+                'quantite': data['quantite'],
+                'prix_total': data['prix_total'],
+                'last_sale': data['last_sale'],
+            })
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _read_partition(history_dir, key):
+    """Read a single monthly partition"""
+    path = partition_path(history_dir, key)
+    if not os.path.exists(path):
+        return empty_history()
+    return pd.read_excel(path)
+
+
+def _overlapping_keys(manifest, start=None, end=None):
+    """
+    List partition keys whose date bounds overlap [start, end], oldest first
+    """
+    keys = []
+    for key, entry in sorted(manifest['partitions'].items()):
+        if start is not None and entry['max_date'] and pd.Timestamp(entry['max_date']) < start:
+            continue
+        if end is not None and entry['min_date'] and pd.Timestamp(entry['min_date']) > end:
+            continue
+        keys.append(key)
+    return keys
+
+
+def append_sale(history_dir, nom_article, quantite, prix_total, date=None):
+    """
+    Append a sale to its monthly partition
+
+    Only the partition of the sale's month is read and rewritten.
+
+    Returns:
+        (rows, revision) of the history including this sale
+    """
+    date = date or pd.Timestamp.now()
+    key = partition_key(date)
+
+    with _lock:
+        os.makedirs(history_dir, exist_ok=True)
+        manifest = load_manifest(history_dir)
+
+        df_part = _read_partition(history_dir, key)
+        new_sale = pd.DataFrame([{
+            'date': pd.Timestamp(date).strftime(DATE_FORMAT),
+            'nom_article': nom_article,
+            'quantite': quantite,
+            'prix_total': prix_total
+        }])
+        df_part = pd.concat([df_part, new_sale], ignore_index=True) if len(df_part) else new_sale
+
+        df_part.to_excel(partition_path(history_dir, key), index=False)
+        manifest['partitions'][key] = _sign(history_dir, key, _summarize(df_part, manifest['partitions'].get(key)))
+        _write_stats(history_dir, key, df_part)
+        save_manifest(history_dir, manifest)
+        return _version(manifest)
+
+
+def read_history(history_dir, start=None, end=None, keys=None):
+    """
+    Read sales, opening only the partitions that overlap the date range
+
+    Args:
+        history_dir: Directory containing the partitions
+        start: Optional inclusive lower bound (Timestamp)
+        end: Optional inclusive upper bound (Timestamp)
+        keys: Optional explicit list of partition keys to read
+
+    Returns:
+        DataFrame with the 'date' column parsed as datetime
+    """
+    manifest = load_manifest(history_dir)
+    if keys is None:
+        keys = _overlapping_keys(manifest, start, end)
+
+    frames = [_read_partition(history_dir, key) for key in keys]
+    frames = [df for df in frames if len(df)]
+    if not frames:
+        df_hist = empty_history()
+        df_hist['date'] = pd.to_datetime(df_hist['date'])
+        return df_hist
+
+    df_hist = pd.concat(frames, ignore_index=True)
+    df_hist['date'] = pd.to_datetime(df_hist['date'])
+
+    if start is not None:
+        df_hist = df_hist[df_hist['date'] >= start]
+    if end is not None:
+        df_hist = df_hist[df_hist['date'] <= end]
+    return df_hist
+
+
+def _version(manifest):
+    """(rows, revision) identifying the content of the history"""
+    return sum(p['rows'] for p in manifest['partitions'].values()), manifest['revision']
+
+
+def read_daily_sales(history_dir):
+    """
+    Per-day, per-article totals of the whole history, with its version
+
+    Read from the partitions' stats files, which stay small however many
+    sales a month holds. Stats that are missing or stale (partition edited,
+    or written by an older version) are rebuilt from the Excel partitions
+    first, outside the lock so sales are not held up meanwhile; the final
+    read is done under the lock so the totals match the returned version.
+
+    Returns:
+        (DataFrame with DAILY_COLUMNS, (rows, revision))
+    """
+    for attempt in range(3):
+        with _lock:
+            manifest = load_manifest(history_dir)
+            keys = sorted(manifest['partitions'])
+            frames = {key: _load_stats(history_dir, key) for key in keys}
+            missing = [key for key in keys if frames[key] is None]
+            if not missing or attempt == 2:
+                for key in missing:
+                    frames[key] = _write_stats(history_dir, key, _read_partition(history_dir, key))
+                frames = [frames[key] for key in keys if len(frames[key])]
+                daily = pd.concat(frames, ignore_index=True) if frames else daily_totals(empty_history())
+                return daily, _version(manifest)
+
+        for key in missing:
+            signature = _file_signature(partition_path(history_dir, key))
+            try:
+                _write_stats(history_dir, key, _read_partition(history_dir, key), signature)
+            except Exception as e:
+                # Partition being rewritten: retried under the lock
+                print(f"⚠️ Lecture de la partition {key} pour ses totaux journaliers: {e}")
+
+
+def get_totals(history_dir):
+    """
+    Get full-range totals from the manifest without opening any partition
+
+    Returns:
+        dict with 'rows', 'total_amount', 'total_quantity' and 'revision'
+        (bumped when the history is replaced or edited outside the application)
+    """
+    manifest = load_manifest(history_dir)
+    partitions = manifest['partitions'].values()
+    return {
+        'revision': manifest['revision'],
+        'rows': _version(manifest)[0],
+        'total_amount': float(sum(p['total_amount'] for p in partitions)),
+        'total_quantity': int(sum(p['total_quantity'] for p in partitions)),
+    }
+
+
+def write_history(history_dir, df_hist, synced=False, cloud_rows=None):
+    """
+    Replace the whole history with the given DataFrame, split by month
+
+    Args:
+        history_dir: Directory containing the partitions
+        df_hist: DataFrame with HISTORY_COLUMNS
+        synced: Mark every row as already present in the cloud
+        cloud_rows: Number of data rows in the cloud history sheet, if known
+
+    Returns:
+        Number of rows written (rows whose date cannot be parsed are skipped)
+    """
+    with _lock:
+        os.makedirs(history_dir, exist_ok=True)
+        old_manifest = load_manifest(history_dir)
+        manifest = {'partitions': {}, 'cloud_rows': cloud_rows,
+                    'revision': old_manifest['revision'] + 1}
+
+        df_hist = df_hist.copy()
+        dates = pd.to_datetime(df_hist['date'], errors='coerce')
+        df_hist = df_hist[dates.notna()]
+        dates = dates[dates.notna()]
+        df_hist['date'] = dates.dt.strftime(DATE_FORMAT)
+
+        for key, df_part in df_hist.groupby(dates.dt.strftime('%Y-%m'), sort=True):
+            df_part = df_part.sort_values('date')[HISTORY_COLUMNS]
+            df_part.to_excel(partition_path(history_dir, key), index=False)
+            entry = _sign(history_dir, key, _summarize(df_part))
+            entry['synced_rows'] = entry['rows'] if synced else 0
+            manifest['partitions'][key] = entry
+            _write_stats(history_dir, key, df_part)
+
+        # Drop partitions that no longer have any rows
+        for key in old_manifest['partitions']:
+            if key not in manifest['partitions']:
+                _remove(partition_path(history_dir, key))
+                _remove(stats_path(history_dir, key))
+
+        save_manifest(history_dir, manifest)
+        return int(len(df_hist))
+
+
+def mark_synced(history_dir, row_counts, cloud_rows):
+    """
+    Record how many rows of each partition are present in the cloud
+
+    Args:
+        history_dir: Directory containing the partitions
+        row_counts: dict of partition key -> number of synced rows
+        cloud_rows: Number of data rows now in the cloud history sheet
+    """
+    with _lock:
+        manifest = load_manifest(history_dir)
+        for key, rows in row_counts.items():
+            if key in manifest['partitions']:
+                manifest['partitions'][key]['synced_rows'] = rows
+        manifest['cloud_rows'] = cloud_rows
+        save_manifest(history_dir, manifest)
+
+
+def migrate_legacy_history(legacy_file, history_dir):
+    """
+    One-time migration of the single historique.xlsx into monthly partitions
+
+    The legacy file is renamed to '<name>.migrated' once split, so the
+    migration never runs twice. Rows without a valid date cannot be put in
+    a partition: they are skipped and reported, and stay in the renamed file.
+
+    Returns:
+        Number of migrated rows, or None if there was nothing to migrate
+    """
+    if not os.path.exists(legacy_file) or exists(history_dir):
+        return None
+
+    df_hist = pd.read_excel(legacy_file)
+    for column in HISTORY_COLUMNS:
+        if column not in df_hist.columns:
+            df_hist[column] = None
+
+    written = write_history(history_dir, df_hist[HISTORY_COLUMNS])
+    os.replace(legacy_file, legacy_file + '.migrated')
+
+    skipped = len(df_hist) - written
+    if skipped:
+        print(f"⚠️ {skipped} vente(s) sans date valide non migrée(s) - "
+              f"elles restent dans '{legacy_file}.migrated'")
+    return written
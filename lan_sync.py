@@ -0,0 +1,374 @@
+"""
+LAN Synchronization Module
+Lets several checkout PCs share one stock: terminals forward mutations to
+the authority instance and queue them locally while it is unreachable
+"""
+
+import functools
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime
+from flask import current_app, g, request, jsonify
+import config
+
+OUTBOX_FILE = os.path.join('data', 'outbox.json')
+IDEMPOTENCY_FILE = os.path.join('data', 'idempotency.json')
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+FORWARD_TIMEOUT_SECONDS = 3
+REPLAY_INTERVAL_SECONDS = 5
+MAX_REMEMBERED_KEYS = 5000
+
+_outbox_lock = threading.RLock()
+_idempotency_lock = threading.Lock()
+_idempotency_cache = None
+
+_STOCK_ITEM_PATH = re.compile(r'^/api/stock/(\d+)$')
+
+
+class AuthorityUnreachable(Exception):
+    """Raised when the authority instance cannot be contacted"""
+
+
+def is_terminal():
+    """Check whether this instance forwards its mutations to an authority"""
+    return config.TERMINAL_MODE == 'terminal'
+
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _save_json(path, data):
+    """Write a JSON file atomically"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def forward(method, path, body=None, key=None):
+    """
+    Send a request to the authority
+
+    Returns:
+        (status code, response bytes, content type)
+
+    Raises:
+        AuthorityUnreachable if the authority cannot be contacted
+    """
+    headers = {'Content-Type': 'application/json'}
+    if key:
+        headers[IDEMPOTENCY_HEADER] = key
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(config.AUTHORITY_URL.rstrip('/') + path, data=data,
+                                 method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=FORWARD_TIMEOUT_SECONDS) as response:
+            return response.status, response.read(), response.headers.get('Content-Type')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read(), e.headers.get('Content-Type')
+    except (urllib.error.URLError, OSError) as e:
+        raise AuthorityUnreachable(str(e))
+
+
+# ===== OUTBOX (TERMINAL SIDE) =====
+
+def load_outbox():
+    """
+    Load the local outbox
+
+    Returns:
+        dict with 'pending' operations (oldest first), 'rejected' ones and
+        'id_map' (local id of an article created offline -> authority id,
+        or None if the authority refused the creation)
+    """
+    outbox = _load_json(OUTBOX_FILE, {'pending': [], 'rejected': []})
+    outbox.setdefault('id_map', {})
+    return outbox
+
+
+def pending_count():
+    return len(load_outbox()['pending'])
+
+
+def enqueue(method, path, body, key, local_id=None):
+    """Append an operation to the outbox, to be replayed in order"""
+    with _outbox_lock:
+        outbox = load_outbox()
+        outbox['pending'].append({
+            'key': key,
+            'method': method,
+            'path': path,
+            'body': body,
+            'local_id': local_id,
+            'queued_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        _save_json(OUTBOX_FILE, outbox)
+
+
+def _remap_ids(op, id_map):
+    """
+    Point an operation at the authority ids of articles created offline
+
+    Returns:
+        (path, body), or None if it targets an article whose creation was refused
+    """
+    path, body = op['path'], op['body']
+    match = _STOCK_ITEM_PATH.match(path)
+    if match and match.group(1) in id_map:
+        if id_map[match.group(1)] is None:
+            return None
+        path = f"/api/stock/{id_map[match.group(1)]}"
+    if isinstance(body, dict) and str(body.get('article_id')) in id_map:
+        if id_map[str(body['article_id'])] is None:
+            return None
+        body = dict(body, article_id=id_map[str(body['article_id'])])
+    return path, body
+
+
+def _reject(outbox, op, error):
+    """Move an operation to the 'rejected' list; a refused creation also dooms its dependents"""
+    op['error'] = error
+    outbox['rejected'].append(op)
+    if op.get('local_id') is not None:
+        outbox['id_map'][str(op['local_id'])] = None
+    print(f"⚠️ Opération refusée par le serveur principal: {op['method']} {op['path']} - {error}")
+
+
+def replay_pending(on_drained=None):
+    """
+    Replay queued operations to the authority, oldest first
+
+    Stops at the first operation the authority cannot take right now
+    (unreachable or 5xx). Operations it refuses (4xx) or that failed after
+    being applied (a 5xx marked 'applied', final since a retry is answered
+    the same) are moved to the 'rejected' list so they do not block the
+    queue, together with later operations on an article whose offline
+    creation was refused.
+
+    The local -> authority id map is saved with the outbox so it survives
+    a replay interrupted between a creation and the operations using its
+    id. It is cleared once the queue is drained and on_drained has
+    replaced the local copy, since the local ids no longer exist then.
+
+    Args:
+        on_drained: Optional callback run once the queue is empty
+
+    Returns:
+        Number of operations still pending
+    """
+    with _outbox_lock:
+        outbox = load_outbox()
+        id_map = outbox['id_map']
+        while outbox['pending']:
+            op = outbox['pending'][0]
+            target = _remap_ids(op, id_map)
+            if target is None:
+                _reject(outbox, op, "Article créé hors ligne refusé par le serveur principal")
+                outbox['pending'].pop(0)
+                _save_json(OUTBOX_FILE, outbox)
+                continue
+
+            path, body = target
+            try:
+                status, content, _ = forward(op['method'], path, body, op['key'])
+            except AuthorityUnreachable:
+                break
+            result = _load_body(content)
+            if status >= 500 and not result.get('applied'):
+                break
+
+            if status >= 400:
+                _reject(outbox, op, result.get('message', f'HTTP {status}'))
+            elif op.get('local_id') is not None and result.get('id') is not None:
+                id_map[str(op['local_id'])] = result['id']
+
+            outbox['pending'].pop(0)
+            _save_json(OUTBOX_FILE, outbox)
+
+        remaining = len(outbox['pending'])
+
+    if remaining == 0:
+        if on_drained:
+            try:
+                on_drained()
+            except AuthorityUnreachable:
+                return remaining
+        _clear_id_map()
+    return remaining
+
+
+def _clear_id_map():
+    """Forget the offline ids once nothing queued can refer to them anymore"""
+    with _outbox_lock:
+        outbox = load_outbox()
+        if outbox['id_map'] and not outbox['pending']:
+            outbox['id_map'] = {}
+            _save_json(OUTBOX_FILE, outbox)
+
+
+def _load_body(content):
+    try:
+        result = json.loads(content)
+        return result if isinstance(result, dict) else {}
+    except ValueError:
+        return {}
+
+
+def start_replay_worker(on_drained=None):
+    """
+    Replay the outbox in the background every REPLAY_INTERVAL_SECONDS
+
+    on_drained runs on every pass that ends with an empty queue, which also
+    keeps the terminal's local copy fresh for the next outage.
+    """
+    def run():
+        while True:
+            try:
+                replay_pending(on_drained)
+            except Exception as e:
+                print(f"❌ Error replaying outbox: {e}")
+            time.sleep(REPLAY_INTERVAL_SECONDS)
+
+    worker = threading.Thread(target=run, name='lan-replay', daemon=True)
+    worker.start()
+    return worker
+
+
+def _flask_response(status, content, content_type):
+    return current_app.response_class(content, status=status,
+                                      content_type=content_type or 'application/json')
+
+
+def forwarded(queue_offline=False, on_success=None):
+    """
+    Route decorator forwarding the request to the authority on terminals
+
+    On a terminal the request is proxied to the authority. If it is
+    unreachable - or older operations are still queued, so order is kept -
+    the view runs on the local copy instead; with queue_offline=True a
+    successful local mutation is also queued for replay.
+
+    Args:
+        queue_offline: Queue the operation when it had to be applied locally
+        on_success: Optional callback receiving the authority response bytes
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not is_terminal():
+                return view(*args, **kwargs)
+
+            body = request.get_json(silent=True)
+            key = request.headers.get(IDEMPOTENCY_HEADER) or str(uuid.uuid4())
+            path = request.full_path.rstrip('?')
+
+            if pending_count() == 0:
+                try:
+                    status, content, content_type = forward(request.method, path, body, key)
+                    if status < 500 or _load_body(content).get('applied'):
+                        if on_success and status < 400:
+                            on_success(content)
+                        return _flask_response(status, content, content_type)
+                except AuthorityUnreachable:
+                    pass
+
+            response = view(*args, **kwargs)
+            if queue_offline:
+                flask_response, status = response if isinstance(response, tuple) else (response, 200)
+                if status < 400:
+                    result = flask_response.get_json(silent=True) or {}
+                    enqueue(request.method, path, body, key, result.get('id'))
+                    result['queued'] = True
+                    result['message'] = result.get('message', '') + ' (hors ligne - en attente de synchronisation)'
+                    return jsonify(result)
+            return response
+        return wrapper
+    return decorator
+
+
+# ===== IDEMPOTENCY (AUTHORITY SIDE) =====
+
+def _remembered():
+    global _idempotency_cache
+    if _idempotency_cache is None:
+        _idempotency_cache = _load_json(IDEMPOTENCY_FILE, {})
+    return _idempotency_cache
+
+
+def mark_applied(applied=True):
+    """
+    Record whether the current request's mutation reached the data files
+
+    Views call it once their change is written (and with False after
+    undoing it), so idempotent() never runs an applied change twice even
+    when the request ends in an error.
+    """
+    g.lan_applied = applied
+
+
+def idempotent(view):
+    """
+    Route decorator running a mutation at most once per Idempotency-Key
+
+    A replayed key gets the stored response of its first execution.
+    Requests without the header run normally. Server errors are not
+    remembered, so the client can retry them, unless the view reported
+    through mark_applied() that its change was written.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+
+        with _idempotency_lock:
+            remembered = _remembered()
+            if key in remembered:
+                stored = remembered[key]
+                return _flask_response(stored['status'], stored['body'].encode('utf-8'), 'application/json')
+
+            response = view(*args, **kwargs)
+            flask_response, status = response if isinstance(response, tuple) else (response, 200)
+
+            # Only outcomes that must not be re-executed are remembered
+            if status < 500 or g.get('lan_applied'):
+                remembered[key] = {'status': status, 'body': flask_response.get_data(as_text=True)}
+                while len(remembered) > MAX_REMEMBERED_KEYS:
+                    remembered.pop(next(iter(remembered)))
+                _save_json(IDEMPOTENCY_FILE, remembered)
+            return response
+    return wrapper
+
+
+def get_status():
+    """Get the LAN mode status for the UI"""
+    status = {
+        'mode': config.TERMINAL_MODE,
+        'authority_url': config.AUTHORITY_URL if is_terminal() else None,
+        'pending': 0,
+        'rejected': [],
+        'authority_reachable': None,
+    }
+    if is_terminal():
+        outbox = load_outbox()
+        status['pending'] = len(outbox['pending'])
+        status['rejected'] = outbox['rejected']
+        try:
+            forward('GET', '/api/lan/status')
+            status['authority_reachable'] = True
+        except AuthorityUnreachable:
+            status['authority_reachable'] = False
+    return status
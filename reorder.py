@@ -0,0 +1,57 @@
+"""
+Reorder Suggestion Module
+Suggests reorder quantities from the per-article sales velocity of sales_stats
+"""
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_LEAD_TIME = 7
+DEFAULT_COVER_DAYS = 14
+
+
+def suggest(df_stock, velocity, lead_time=DEFAULT_LEAD_TIME, cover_days=DEFAULT_COVER_DAYS):
+    """
+    Compute days of cover and reorder quantities for every article
+
+    The reorder point is the demand expected during the lead time plus the
+    article's min_stock as safety stock; the suggested order brings stock
+    back to cover lead_time + cover_days of demand above that safety stock.
+    When several rows share a name, its velocity is credited to the first one.
+
+    Args:
+        df_stock: Typed stock DataFrame
+        velocity: Series of units per day indexed by article name
+        lead_time: Supplier lead time in days
+        cover_days: Days of demand an order should cover after delivery
+
+    Returns:
+        DataFrame sorted by days of cover, most urgent first
+    """
+    names = df_stock['nom_article'].astype(str).to_numpy()
+    rate = velocity.reindex(names).fillna(0.0).to_numpy()
+    # Sales are recorded by name: rows sharing a name must not each get the full velocity
+    rate = np.where(df_stock['nom_article'].duplicated().to_numpy(), 0.0, rate)
+    # Unreadable cells are NaN: such articles get no cover, point or suggestion
+    stock = df_stock['stock'].to_numpy(dtype=np.float64, na_value=np.nan)
+    min_stock = df_stock['min_stock'].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(rate > 0, stock / rate, np.inf)
+    reorder_point = rate * lead_time + min_stock
+    target = rate * (lead_time + cover_days) + min_stock
+    suggested = np.ceil(np.maximum(target - stock, 0))
+
+    result = pd.DataFrame({
+        'id': df_stock['id'].to_numpy(),
+        'nom_article': names,
+        'stock': df_stock['stock'].array,
+        'min_stock': df_stock['min_stock'].array,
+        'velocity': rate.round(3),
+        'days_of_cover': days_of_cover.round(1),
+        'reorder_point': pd.array(np.ceil(reorder_point), dtype='Int64'),
+        'suggested_qty': pd.array(suggested, dtype='Int64'),
+        'needs_reorder': (stock <= reorder_point) & (suggested > 0),
+    })
+    return result.sort_values('days_of_cover', kind='stable')
+
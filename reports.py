@@ -0,0 +1,265 @@
+"""
+Inventory Reports Module
+Stock valuation, dead stock and ABC (Pareto) revenue classes, computed by
+joining the stock table against the per-article sales totals of sales_stats
+"""
+
+import gzip
+import threading
+import numpy as np
+import pandas as pd
+import history_store
+import sales_stats
+import stock_store
+
+DEFAULT_TOP = 20
+DEFAULT_DEAD_DAYS = 90
+
+# Rows listed by the dead stock and ABC reports (totals always cover every article)
+DEFAULT_LIMIT = 100
+
+# Cumulative revenue shares closing the A and B classes (the rest is C)
+ABC_THRESHOLDS = {'A': 0.80, 'B': 0.95}
+
+# Stock row -> aggregate row positions, valid while both name lists are unchanged
+_positions = {
+    'categories': None,
+    'index': None,
+    'position': None,
+}
+
+# Encoded report bodies, valid for a single (stock version, history rows and revision, day)
+_memo = {
+    'key': None,
+    'bodies': {},
+}
+_lock = threading.Lock()
+
+
+def _join(df_stock, sales):
+    """
+    Align the sales aggregates on the stock rows (articles never sold get zeros)
+
+    Names are looked up once per category, then broadcast through the codes;
+    the lookup is reused until the catalog or the set of sold names changes.
+    Sales are recorded by name, so when several rows share a name its
+    quantity and revenue go to the first of them only (the last sale date
+    applies to all), keeping totals equal to the history's.
+    """
+    if len(sales) == 0:
+        zeros = np.zeros(len(df_stock))
+        return zeros, zeros, np.full(len(df_stock), np.datetime64('NaT'), dtype='datetime64[ns]')
+    names = df_stock['nom_article'].cat
+    with _lock:
+        if _positions['categories'] is not names.categories or _positions['index'] is not sales.index:
+            _positions['categories'] = names.categories
+            _positions['index'] = sales.index
+            _positions['position'] = sales.index.get_indexer(names.categories.astype(str))
+        position = _positions['position'][names.codes.to_numpy()]
+    sold = position >= 0
+    credited = sold & ~df_stock['nom_article'].duplicated().to_numpy()
+    position = np.where(sold, position, 0)
+    return (np.where(credited, sales['quantite'].to_numpy()[position], 0.0),
+            np.where(credited, sales['prix_total'].to_numpy()[position], 0.0),
+            np.where(sold, sales['last_sale'].to_numpy()[position], np.datetime64('NaT')))
+
+
+def _top(idx, keys, limit):
+    """The `limit` entries of idx with the largest keys, largest first"""
+    limit = max(min(limit, len(idx)), 0)
+    if limit < len(idx):
+        best = np.argpartition(-keys, limit - 1)[:limit] if limit else np.array([], dtype=np.int64)
+        idx, keys = idx[best], keys[best]
+    return idx[np.argsort(-keys, kind='stable')]
+
+
+def _names(df_stock, idx):
+    """Article names of the given row positions, without decoding the whole column"""
+    names = df_stock['nom_article'].cat
+    return names.categories.astype(str).to_numpy()[names.codes.to_numpy()[idx]]
+
+
+def _dates(values):
+    """Format datetime64 values as strings, NaT -> None"""
+    formatted = pd.DatetimeIndex(values).strftime(history_store.DATE_FORMAT)
+    return [None if pd.isna(value) else value for value in formatted]
+
+
+def valuation(df_stock, top=DEFAULT_TOP):
+    """
+    Value the stock on hand at its selling price
+
+    Args:
+        df_stock: Typed stock DataFrame
+        top: Number of most valuable articles to list
+
+    Returns:
+        dict with the totals and the `top` articles by stock value
+    """
+    stock = df_stock['stock'].to_numpy(dtype=np.float64, na_value=np.nan)
+    min_stock = df_stock['min_stock'].to_numpy(dtype=np.float64, na_value=np.nan)
+    value = stock * df_stock['prix'].to_numpy()
+    # Articles with an unreadable stock or price are counted apart, not as 0
+    known = np.flatnonzero(~np.isnan(value))
+    total_value = float(value[known].sum())
+    low = stock <= min_stock
+
+    # Partial sort: only the top rows are ordered
+    best = _top(known, value[known], top)
+
+    return {
+        'articles': int(len(df_stock)),
+        'unreadable': int(len(df_stock) - len(known)),
+        'units': int(np.nansum(stock)),
+        'total_value': total_value,
+        'out_of_stock': int((stock <= 0).sum()),
+        'low_stock': int(low.sum()),
+        'low_stock_value': float(np.nansum(value[low])),
+        'top': [{
+            'id': int(df_stock['id'].iat[i]),
+            'nom_article': str(df_stock['nom_article'].iat[i]),
+            'stock': int(stock[i]),
+            'prix': float(df_stock['prix'].iat[i]),
+            'value': float(value[i]),
+            'share': round(float(value[i]) / total_value, 4) if total_value else 0.0,
+        } for i in best],
+    }
+
+
+def dead_stock(df_stock, sales, days=DEFAULT_DEAD_DAYS, limit=DEFAULT_LIMIT, today=None):
+    """
+    List articles in stock that have not sold for `days` days
+
+    Args:
+        df_stock: Typed stock DataFrame
+        sales: Per-article totals from sales_stats.get()
+        days: Days without a sale after which stock counts as dead
+        limit: Number of dead articles to list
+        today: Reference date (defaults to now)
+
+    Returns:
+        dict with the totals and the `limit` dead articles tying up the most value
+    """
+    today = pd.Timestamp(today or pd.Timestamp.now()).normalize()
+    _, _, last_sale = _join(df_stock, sales)
+    stock = df_stock['stock'].to_numpy(dtype=np.float64, na_value=np.nan)
+    value = stock * df_stock['prix'].to_numpy()
+
+    cutoff = np.datetime64(today - pd.Timedelta(days=days), 'ns')
+    never_sold = np.isnat(last_sale)
+    dead = (stock > 0) & (never_sold | (last_sale < cutoff))
+
+    idx = np.flatnonzero(dead)
+    listed = _top(idx, value[idx], limit)
+    age = (np.datetime64(today, 'D') - last_sale[listed].astype('datetime64[D]')).astype(np.int64)
+
+    items = pd.DataFrame({
+        'id': df_stock['id'].to_numpy()[listed],
+        'nom_article': _names(df_stock, listed),
+        'stock': stock[listed].astype(np.int64),
+        'value': value[listed],
+        'last_sale': _dates(last_sale[listed]),
+        'days_since_sale': np.where(never_sold[listed], None, age.astype(object)),
+    })
+    return {
+        'days': days,
+        'count': int(len(idx)),
+        'total_value': float(np.nansum(value[idx])),
+        'never_sold': int(never_sold[idx].sum()),
+        'items': stock_store.records(items),
+    }
+
+
+def abc(df_stock, sales, limit=DEFAULT_LIMIT, classe=None):
+    """
+    Classify articles by their share of the revenue (Pareto / ABC analysis)
+
+    Articles are ranked by revenue; an article is A while the articles
+    ranked before it make less than 80% of the revenue, B below 95% and C
+    after that. Articles that never sold are C.
+
+    Args:
+        df_stock: Typed stock DataFrame
+        sales: Per-article totals from sales_stats.get()
+        limit: Number of ranked articles to list
+        classe: Only list articles of this class ('A', 'B' or 'C')
+
+    Returns:
+        dict with per-class totals and the `limit` best ranked articles
+    """
+    quantite, revenue, _ = _join(df_stock, sales)
+    total = float(revenue.sum())
+
+    # Only sold articles need ranking; the others follow as C in catalog order
+    sold = revenue > 0
+    positive = np.flatnonzero(sold)
+    order = np.concatenate([positive[np.argsort(-revenue[positive], kind='stable')], np.flatnonzero(~sold)])
+    ranked = revenue[order]
+    share = ranked / total if total else np.zeros(len(ranked))
+    cumulative = np.cumsum(share)
+    before = cumulative - share
+
+    classes = np.full(len(ranked), 'C', dtype=object)
+    classes[(before < ABC_THRESHOLDS['B']) & (ranked > 0)] = 'B'
+    classes[(before < ABC_THRESHOLDS['A']) & (ranked > 0)] = 'A'
+
+    ranks = np.flatnonzero(classes == classe) if classe else np.arange(len(ranked))
+    ranks = ranks[:max(limit, 0)]
+    items = pd.DataFrame({
+        'id': df_stock['id'].to_numpy()[order[ranks]],
+        'nom_article': _names(df_stock, order[ranks]),
+        'revenue': ranked[ranks],
+        'quantity': quantite[order[ranks]].astype(np.int64),
+        'share': share[ranks].round(4),
+        'cumulative_share': cumulative[ranks].round(4),
+        'class': classes[ranks],
+    })
+    summary = {}
+    for label in ('A', 'B', 'C'):
+        mask = classes == label
+        class_revenue = float(ranked[mask].sum())
+        summary[label] = {
+            'articles': int(mask.sum()),
+            'revenue': class_revenue,
+            'share': round(class_revenue / total, 4) if total else 0.0,
+        }
+    return {'total_revenue': total, 'classes': summary, 'items': stock_store.records(items)}
+
+
+def encoded_report(name, params, build, stock_file, history_dir, compressed=False):
+    """
+    Get the JSON body of a report, computing it once per data version
+
+    The memo is keyed by the stock data version, the history version and
+    the current day, so any stock mutation or new sale invalidates it. The
+    report is built from the sales_stats snapshot, which is never mutated.
+
+    Args:
+        name: Report name
+        params: Hashable request parameters of the report
+        build: Function(df_stock, sales) returning the report payload
+        stock_file: Path to stock.xlsx
+        history_dir: Directory containing the history partitions
+        compressed: Return the gzip-compressed body
+    """
+    df_stock = stock_store.load(stock_file)
+    stats = sales_stats.get(history_dir)
+    key = (stock_store.data_version(), stats['rows'], stats['revision'], pd.Timestamp.now().date())
+
+    with _lock:
+        if _memo['key'] != key:
+            _memo['key'] = key
+            _memo['bodies'] = {}
+        entry = _memo['bodies'].get((name, params))
+
+    if entry is None:
+        entry = {'body': stock_store.dumps(build(df_stock, stats['totals'])), 'gzip_body': None}
+        with _lock:
+            if _memo['key'] == key:
+                _memo['bodies'][(name, params)] = entry
+
+    if not compressed:
+        return entry['body']
+    if entry['gzip_body'] is None:
+        entry['gzip_body'] = gzip.compress(entry['body'], compresslevel=5)
+    return entry['gzip_body']
@@ -0,0 +1,211 @@
+"""
+Sales Statistics Module
+Per-article sales aggregates built from the history's daily totals and kept
+current sale by sale, shared by the reorder suggestions and the reports
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+import history_store
+
+# Exponential smoothing of daily sales, equivalent to a ~30 day moving average
+SMOOTHING_SPAN_DAYS = 30
+ALPHA = 2 / (SMOOTHING_SPAN_DAYS + 1)
+
+# Sales older than this weigh less than (1 - ALPHA) ** 180 ~ 0.0006% and are left out
+HORIZON_DAYS = 180
+
+# Current snapshot: a dict replaced as a whole and never mutated, so readers
+# use it without holding the lock. It holds the history version it reflects
+# ('rows', 'revision'), the smoothed 'velocity' as of day 'as_of' and the
+# whole-history 'totals' per article.
+_state = {
+    'snapshot': None,
+}
+# _lock only guards swapping the snapshot; _rebuild_lock lets one thread at a
+# time read the history while sales keep being recorded
+_lock = threading.Lock()
+_rebuild_lock = threading.Lock()
+
+
+def _day(date):
+    """Truncate a date to numpy day precision"""
+    return np.datetime64(pd.Timestamp(date).date(), 'D')
+
+
+def compute_velocity(dates, names, quantities, as_of):
+    """
+    Vectorized exponential smoothing of daily sales per article
+
+    The smoothed value after day T is sum(ALPHA * (1 - ALPHA) ** (T - t) * q_t)
+    over every sale, so it is computed in one pass without building the
+    article x day matrix. The sum is linear in q_t, so daily totals give the
+    same result as the individual sales.
+
+    Args:
+        dates: Sale dates (array-like of datetime64)
+        names: Article name of each sale
+        quantities: Quantity of each sale
+        as_of: Day the velocity is computed for
+
+    Returns:
+        pandas Series of units sold per day, indexed by article name
+    """
+    names = pd.Categorical(names)
+    days = np.asarray(dates, dtype='datetime64[ns]').astype('datetime64[D]')
+    age = (_day(as_of) - days).astype(np.int64).clip(min=0)
+    weights = ALPHA * np.power(1 - ALPHA, age) * np.asarray(quantities, dtype=np.float64)
+    velocity = np.bincount(names.codes[names.codes >= 0], weights=weights[names.codes >= 0],
+                           minlength=len(names.categories))
+    return pd.Series(velocity, index=names.categories.astype(str))
+
+
+def aggregate_sales(dates, names, quantities, amounts):
+    """
+    Total quantity, revenue and last sale date per article in one pass
+
+    Args:
+        dates: Sale dates (array-like of datetime64)
+        names: Article name of each sale
+        quantities: Quantity of each sale
+        amounts: Total price of each sale
+
+    Returns:
+        DataFrame with 'quantite', 'prix_total' and 'last_sale' columns, indexed by article name
+    """
+    names = pd.Categorical(names)
+    codes = names.codes
+    valid = codes >= 0
+    size = len(names.categories)
+    quantite = np.bincount(codes[valid], weights=np.asarray(quantities, dtype=np.float64)[valid], minlength=size)
+    prix_total = np.bincount(codes[valid], weights=np.asarray(amounts, dtype=np.float64)[valid], minlength=size)
+
+    days = np.asarray(dates, dtype='datetime64[ns]')[valid]
+    last_sale = np.full(size, np.datetime64('NaT'), dtype='datetime64[ns]')
+    if len(days):
+        # Sorting by (article, date) puts each article's latest sale last in its run
+        order = np.lexsort((days, codes[valid]))
+        sorted_codes = codes[valid][order]
+        ends = np.flatnonzero(np.r_[sorted_codes[1:] != sorted_codes[:-1], True])
+        last_sale[sorted_codes[ends]] = days[order][ends]
+
+    return pd.DataFrame({
+        'quantite': quantite,
+        'prix_total': prix_total,
+        'last_sale': last_sale,
+    }, index=names.categories.astype(str))
+
+
+def _decay(velocity, from_day, to_day):
+    """Age a smoothed velocity by the days without sales in between (returns a new Series)"""
+    elapsed = max(int((to_day - from_day).astype(np.int64)), 0)
+    return velocity * (1 - ALPHA) ** elapsed
+
+
+def build(daily, version, today):
+    """
+    Build a snapshot from per-day, per-article totals
+
+    Args:
+        daily: DataFrame with history_store.DAILY_COLUMNS
+        version: (rows, revision) of the history the totals come from
+        today: Day the velocity is computed for
+    """
+    recent = daily[daily['day'] >= pd.Timestamp(today) - pd.Timedelta(days=HORIZON_DAYS)]
+    return {
+        'rows': version[0],
+        'revision': version[1],
+        'as_of': today,
+        'velocity': compute_velocity(recent['day'].to_numpy(), recent['nom_article'].to_numpy(),
+                                     recent['quantite'].to_numpy(), today),
+        'totals': aggregate_sales(daily['last_sale'].to_numpy(), daily['nom_article'].to_numpy(),
+                                  daily['quantite'].to_numpy(), daily['prix_total'].to_numpy()),
+    }
+
+
+def get(history_dir):
+    """
+    Get the current sales statistics
+
+    The snapshot is rebuilt only when the history changed other than through
+    record_sale (restore, migration, partition edited in Excel). The rebuild
+    reads the daily totals without holding _lock, so recording a sale never
+    waits for it.
+
+    Returns:
+        dict with 'velocity' (units per day as of today, by article name),
+        'totals' (see aggregate_sales), 'rows' and 'revision'
+    """
+    today = _day(pd.Timestamp.now())
+    totals = history_store.get_totals(history_dir)
+    version = (totals['rows'], totals['revision'])
+
+    snapshot = _state['snapshot']
+    if snapshot is None or (snapshot['rows'], snapshot['revision']) != version:
+        with _rebuild_lock:
+            snapshot = _state['snapshot']
+            if snapshot is None or (snapshot['rows'], snapshot['revision']) != version:
+                daily, built_version = history_store.read_daily_sales(history_dir)
+                snapshot = build(daily, built_version, today)
+                with _lock:
+                    _state['snapshot'] = snapshot
+
+    return {**snapshot, 'velocity': _decay(snapshot['velocity'], snapshot['as_of'], today)}
+
+
+def _add_to_totals(totals, name, quantite, prix_total, date):
+    """
+    Return new totals with one more sale of `name`
+
+    The new frame reuses the index object when the article already sold, so
+    lookups keyed on it (reports._join) stay valid.
+    """
+    if name not in totals.index:
+        row = pd.DataFrame({
+            'quantite': [float(quantite)],
+            'prix_total': [float(prix_total)],
+            'last_sale': np.array([date], dtype='datetime64[ns]'),
+        }, index=[name])
+        return pd.concat([totals, row])
+    i = totals.index.get_loc(name)
+    quantities = totals['quantite'].to_numpy().copy()
+    amounts = totals['prix_total'].to_numpy().copy()
+    last_sale = totals['last_sale'].to_numpy().copy()
+    quantities[i] += quantite
+    amounts[i] += prix_total
+    if np.isnat(last_sale[i]) or last_sale[i] < date:
+        last_sale[i] = date
+    return pd.DataFrame({
+        'quantite': quantities,
+        'prix_total': amounts,
+        'last_sale': last_sale,
+    }, index=totals.index)
+
+
+def record_sale(nom_article, quantite, prix_total, version, date=None):
+    """
+    Fold a new sale into the current snapshot without re-reading the history
+
+    The sale applies only if it is the next row of the history the snapshot
+    reflects: a sale already counted by a rebuild is skipped, and after a
+    gap the next get() rebuilds from the history instead.
+
+    Args:
+        version: (rows, revision) returned by history_store.append_sale
+    """
+    date = pd.Timestamp(date or pd.Timestamp.now())
+    day = _day(date)
+    name = str(nom_article)
+    rows, revision = version
+    with _lock:
+        snapshot = _state['snapshot']
+        if snapshot is None or revision != snapshot['revision'] or rows != snapshot['rows'] + 1:
+            return
+        as_of = max(day, snapshot['as_of'])
+        velocity = _decay(snapshot['velocity'], snapshot['as_of'], as_of)
+        weight = ALPHA * (1 - ALPHA) ** int((as_of - day).astype(np.int64))
+        velocity.loc[name] = velocity.get(name, 0.0) + weight * quantite
+        totals = _add_to_totals(snapshot['totals'], name, quantite, prix_total, date.to_datetime64())
+        _state['snapshot'] = {**snapshot, 'rows': rows, 'as_of': as_of, 'velocity': velocity,
+                              'totals': totals}
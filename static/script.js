@@ -7,17 +7,61 @@
 let stockData = [];
 let editingId = null;
 
+// Catalog as last confirmed by the server, and as displayed (queued sales applied)
+const serverItems = new Map();
+const stockById = new Map();
+const rowById = new Map();
+let stockEtag = null;
+let refreshSeq = 0;
+
+// Sales waiting to reach the server, oldest first (mirrors the IndexedDB outbox)
+let pendingSales = [];
+let flushPromise = null;
+const saleOutcomes = new Map();
+
+// Articles already notified as low stock
+const alertedIds = new Set();
+
+// Current stock table search filter
+let stockFilter = '';
+let renderToken = 0;
+
+// Requests slower than this are treated as the server being unreachable
+const REQUEST_TIMEOUT_MS = 5000;
+
+// Rows inserted per animation frame when rendering the whole catalog
+const RENDER_CHUNK_SIZE = 2000;
+
+// Maximum articles listed in the sale dropdown
+const MAX_SALE_OPTIONS = 200;
+
+const PRICE_FORMAT = new Intl.NumberFormat('fr-DZ', {
+    style: 'decimal',
+    minimumFractionDigits: 2,
+    maximumFractionDigits: 2
+});
+
 // Initialize on page load
-document.addEventListener('DOMContentLoaded', function () {
+document.addEventListener('DOMContentLoaded', async function () {
     // Request notification permission
     requestNotificationPermission();
 
-    // Load initial stock data
+    // Row buttons use one delegated handler instead of one per row
+    document.getElementById('stockTableBody').addEventListener('click', onStockTableClick);
+
+    // Show the cached catalog and queued sales at once, then refresh from the server
+    await loadLocalState();
     refreshStock();
+    flushOutbox();
 
-    // Check for alerts every 5 seconds
+    // Check for alerts every 5 seconds (computed from the local catalog)
     setInterval(checkAlerts, 5000);
 
+    // Refresh the catalog in the background (304 when unchanged) and retry queued sales
+    setInterval(refreshStock, 30000);
+    setInterval(flushOutbox, 10000);
+    window.addEventListener('online', flushOutbox);
+
     // Update sync status immediately and every 10 seconds
     updateSyncStatus();
     setInterval(updateSyncStatus, 10000);
@@ -32,66 +76,342 @@ function requestNotificationPermission() {
     }
 }
 
+/**
+ * Fetch with a timeout, so a slow or restarting server counts as offline
+ */
+async function fetchWithTimeout(url, options = {}, timeout = REQUEST_TIMEOUT_MS) {
+    const controller = new AbortController();
+    const timer = setTimeout(() => controller.abort(), timeout);
+    try {
+        return await fetch(url, { ...options, signal: controller.signal });
+    } finally {
+        clearTimeout(timer);
+    }
+}
+
+/**
+ * Generate a unique key so a resent sale is only applied once by the server
+ */
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+
+// ===== LOCAL STORAGE (INDEXEDDB) =====
+
+const DB_NAME = 'gestion-stock';
+const DB_VERSION = 1;
+let dbPromise = null;
+
+/**
+ * Open the IndexedDB database holding the catalog and the sales outbox
+ */
+function openDatabase() {
+    if (!dbPromise) {
+        dbPromise = new Promise((resolve, reject) => {
+            if (!('indexedDB' in window)) {
+                reject(new Error('IndexedDB indisponible'));
+                return;
+            }
+            const request = indexedDB.open(DB_NAME, DB_VERSION);
+            request.onupgradeneeded = () => {
+                const db = request.result;
+                db.createObjectStore('catalog', { keyPath: 'id' });
+                db.createObjectStore('outbox', { keyPath: 'key' });
+                db.createObjectStore('meta');
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+    return dbPromise;
+}
+
+/**
+ * Run operations on one object store and resolve with the returned request's result
+ */
+async function withStore(storeName, mode, callback) {
+    const db = await openDatabase();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(storeName, mode);
+        const request = callback(tx.objectStore(storeName));
+        tx.oncomplete = () => resolve(request ? request.result : undefined);
+        tx.onerror = () => reject(tx.error);
+        tx.onabort = () => reject(tx.error);
+    });
+}
+
+/**
+ * Load the cached catalog and the queued sales
+ */
+async function loadLocalState() {
+    try {
+        const [items, sales, etag] = await Promise.all([
+            withStore('catalog', 'readonly', store => store.getAll()),
+            withStore('outbox', 'readonly', store => store.getAll()),
+            withStore('meta', 'readonly', store => store.get('stockEtag'))
+        ]);
+        pendingSales = sales.sort((a, b) => a.queuedAt - b.queuedAt);
+        stockEtag = items.length > 0 ? etag || null : null;
+        items.forEach(item => serverItems.set(item.id, item));
+    } catch (error) {
+        console.error('Local cache unavailable:', error);
+    }
+    rebuildDisplayedStock();
+    renderStockTable();
+    renderPendingCount();
+}
+
+/**
+ * Persist changed and removed catalog items
+ */
+function saveCatalogChanges(changed, removedIds) {
+    if (changed.length === 0 && removedIds.length === 0) return;
+    withStore('catalog', 'readwrite', store => {
+        changed.forEach(item => store.put(item));
+        removedIds.forEach(id => store.delete(id));
+    }).catch(error => console.error('Catalog cache error:', error));
+}
+
+function saveMeta(name, value) {
+    withStore('meta', 'readwrite', store => store.put(value, name))
+        .catch(error => console.error('Catalog cache error:', error));
+}
+
+// ===== STOCK CATALOG =====
+
 /**
  * Refresh stock data from server
  */
 async function refreshStock() {
+    const seq = ++refreshSeq;
     try {
-        const response = await fetch('/api/stock');
-        stockData = await response.json();
-        renderStockTable();
-        updateSaleArticleSelect();
+        const headers = stockEtag ? { 'If-None-Match': stockEtag } : {};
+        const response = await fetchWithTimeout('/api/stock', { headers, cache: 'no-store' });
+        if (response.status === 304) return;
+        if (!response.ok) throw new Error('API Error');
+
+        const items = await response.json();
+        // A refresh started later already has (or will bring) a newer catalog
+        if (seq !== refreshSeq) return;
+        applyServerCatalog(items);
+        stockEtag = response.headers.get('ETag');
+        saveMeta('stockEtag', stockEtag);
     } catch (error) {
-        showAlert('Erreur lors du chargement des données', 'error');
-        console.error('Error:', error);
+        // Keep working on the cached catalog while the server is unreachable
+        console.error('Error refreshing stock:', error);
+        if (serverItems.size === 0) {
+            showAlert('Erreur lors du chargement des données', 'error');
+        }
     }
 }
 
+/**
+ * Merge a full server catalog, touching only the rows that changed
+ */
+function applyServerCatalog(items) {
+    const changed = [];
+    const seen = new Set();
+
+    items.forEach(item => {
+        seen.add(item.id);
+        const previous = serverItems.get(item.id);
+        if (!previous || !sameItem(previous, item)) {
+            changed.push(item);
+        }
+    });
+    const removedIds = [...serverItems.keys()].filter(id => !seen.has(id));
+
+    updateServerItems(changed, removedIds);
+}
+
+function sameItem(a, b) {
+    return a.nom_article === b.nom_article && a.stock === b.stock &&
+        a.prix === b.prix && a.min_stock === b.min_stock;
+}
+
+/**
+ * Apply server-confirmed changes to the cache and to the affected rows only
+ */
+function updateServerItems(changed, removedIds = []) {
+    changed.forEach(item => serverItems.set(item.id, item));
+    removedIds.forEach(id => serverItems.delete(id));
+    saveCatalogChanges(changed, removedIds);
+
+    if (rowById.size === 0 && serverItems.size > 0) {
+        // First load: render the whole table in chunks
+        rebuildDisplayedStock();
+        renderStockTable();
+        return;
+    }
+    updateStockRows(changed.map(item => item.id).concat(removedIds));
+}
+
+/**
+ * Quantity of an article sold in queued sales
+ */
+function pendingQuantity(id) {
+    return pendingSales.reduce((total, sale) => total + (sale.article_id === id ? sale.quantite : 0), 0);
+}
+
+/**
+ * Displayed version of an article: server stock minus its queued sales
+ */
+function displayedItem(item) {
+    const pending = pendingQuantity(item.id);
+    return pending ? { ...item, stock: item.stock - pending, pending } : item;
+}
+
+function rebuildDisplayedStock() {
+    stockById.clear();
+    serverItems.forEach((item, id) => stockById.set(id, displayedItem(item)));
+    stockData = Array.from(stockById.values());
+}
+
+/**
+ * Update, add or remove the rows of the given articles
+ */
+function updateStockRows(ids) {
+    if (ids.length === 0) return;
+    const tbody = document.getElementById('stockTableBody');
+
+    ids.forEach(id => {
+        const item = serverItems.get(id);
+        const row = rowById.get(id);
+        if (!item) {
+            stockById.delete(id);
+            if (row) row.remove();
+            rowById.delete(id);
+            return;
+        }
+
+        const displayed = displayedItem(item);
+        stockById.set(id, displayed);
+        if (row) {
+            fillStockRow(row, displayed);
+        } else {
+            if (rowById.size === 0) tbody.innerHTML = '';
+            const newRow = createStockRow(displayed);
+            rowById.set(id, newRow);
+            tbody.appendChild(newRow);
+        }
+    });
+
+    stockData = Array.from(stockById.values());
+    if (stockById.size === 0) renderEmptyStock();
+    checkAlerts();
+}
+
+function renderEmptyStock() {
+    document.getElementById('stockTableBody').innerHTML =
+        '<tr><td colspan="6" style="text-align: center; padding: 30px;">Aucun article en stock</td></tr>';
+}
+
 /**
  * Render the stock table
  */
 function renderStockTable() {
     const tbody = document.getElementById('stockTableBody');
+    const token = ++renderToken;
     tbody.innerHTML = '';
+    rowById.clear();
 
     if (stockData.length === 0) {
-        tbody.innerHTML = '<tr><td colspan="6" style="text-align: center; padding: 30px;">Aucun article en stock</td></tr>';
+        renderEmptyStock();
         return;
     }
 
-    stockData.forEach(item => {
-        const row = document.createElement('tr');
-
-        // Check if stock is low
-        const isLowStock = item.stock <= item.min_stock;
-        if (isLowStock) {
-            row.classList.add('low-stock');
+    // Insert rows in chunks so a large catalog never blocks the page; rows
+    // changed in between are read from stockById and never duplicated
+    const ids = stockData.map(item => item.id);
+    let index = 0;
+    const renderChunk = () => {
+        if (token !== renderToken) return;
+        const fragment = document.createDocumentFragment();
+        const end = Math.min(index + RENDER_CHUNK_SIZE, ids.length);
+        for (; index < end; index++) {
+            const item = stockById.get(ids[index]);
+            if (!item || rowById.has(item.id)) continue;
+            const row = createStockRow(item);
+            rowById.set(item.id, row);
+            fragment.appendChild(row);
+        }
+        tbody.appendChild(fragment);
+        if (index < ids.length) {
+            requestAnimationFrame(renderChunk);
         }
+    };
+    renderChunk();
+}
 
-        row.innerHTML = `
-            <td>${item.nom_article}</td>
-            <td>${item.stock} ${isLowStock ? '⚠️' : ''}</td>
-            <td>${formatPrice(item.prix)}</td>
-            <td>${item.min_stock}</td>
-            <td class="action-buttons">
-                <button class="btn btn-warning btn-sm" onclick="editProduct(${item.id})">Modifier</button>
-                <button class="btn btn-danger btn-sm" onclick="deleteProduct(${item.id})">Supprimer</button>
-            </td>
-        `;
+/**
+ * Build the table row of an article
+ */
+function createStockRow(item) {
+    const row = document.createElement('tr');
+    row.dataset.id = item.id;
+    row.innerHTML = `
+        <td></td>
+        <td></td>
+        <td></td>
+        <td></td>
+        <td class="action-buttons">
+            <button class="btn btn-warning btn-sm" data-action="edit">Modifier</button>
+            <button class="btn btn-danger btn-sm" data-action="delete">Supprimer</button>
+        </td>
+    `;
+    fillStockRow(row, item);
+    return row;
+}
 
-        tbody.appendChild(row);
-    });
+/**
+ * Write an article's values into its row
+ */
+function fillStockRow(row, item) {
+    const cells = row.cells;
+
+    // Check if stock is low
+    const lowStock = isLowStock(item);
+    row.classList.toggle('low-stock', lowStock);
+    row.classList.toggle('pending-sale', Boolean(item.pending));
+
+    // Cells unreadable in stock.xlsx come as null
+    cells[0].textContent = item.nom_article;
+    cells[1].textContent = `${item.stock ?? '?'} ${lowStock ? '⚠️' : ''}${item.pending ? ' ⏳' : ''}`;
+    cells[1].title = item.pending ? `${item.pending} vendu(s) en attente d'envoi` : '';
+    cells[2].textContent = item.prix === null ? '?' : formatPrice(item.prix);
+    cells[3].textContent = item.min_stock ?? '?';
+    row.style.display = matchesStockFilter(item) ? '' : 'none';
+}
+
+/**
+ * Handle the Modifier / Supprimer buttons of the stock table
+ */
+function onStockTableClick(event) {
+    const button = event.target.closest('button[data-action]');
+    if (!button) return;
+    const id = parseInt(button.closest('tr').dataset.id);
+    if (button.dataset.action === 'edit') {
+        editProduct(id);
+    } else if (button.dataset.action === 'delete') {
+        deleteProduct(id);
+    }
+}
+
+/**
+ * Whether an article is at or below its minimum (never for unreadable cells)
+ */
+function isLowStock(item) {
+    return Number.isInteger(item.stock) && Number.isInteger(item.min_stock) && item.stock <= item.min_stock;
 }
 
 /**
  * Format price with currency
  */
 function formatPrice(price) {
-    return new Intl.NumberFormat('fr-DZ', {
-        style: 'decimal',
-        minimumFractionDigits: 2,
-        maximumFractionDigits: 2
-    }).format(price) + ' TND';
+    return PRICE_FORMAT.format(price) + ' TND';
 }
 
 /**
@@ -109,14 +429,14 @@ function openAddModal() {
  * Edit product
  */
 function editProduct(id) {
-    const product = stockData.find(item => item.id === id);
+    const product = stockById.get(id);
     if (!product) return;
 
     editingId = id;
     document.getElementById('modalTitle').textContent = 'Modifier l\'Article';
     document.getElementById('productId').value = id;
     document.getElementById('nom_article').value = product.nom_article;
-    document.getElementById('stock').value = product.stock;
+    document.getElementById('stock').value = serverItems.get(id).stock;
     document.getElementById('prix').value = product.prix;
     document.getElementById('min_stock').value = product.min_stock;
     document.getElementById('productModal').style.display = 'flex';
@@ -144,11 +464,13 @@ async function saveProduct(event) {
         min_stock: parseInt(document.getElementById('min_stock').value)
     };
 
+    const productId = editingId;
+
     try {
         let response;
-        if (editingId) {
+        if (productId) {
             // Update existing product
-            response = await fetch(`/api/stock/${editingId}`, {
+            response = await fetch(`/api/stock/${productId}`, {
                 method: 'PUT',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(formData)
@@ -167,7 +489,14 @@ async function saveProduct(event) {
         if (result.success) {
             showAlert(result.message, 'success');
             closeProductModal();
-            refreshStock();
+
+            // Update only this article's row instead of reloading the catalog
+            const id = productId || result.id;
+            if (id !== undefined) {
+                updateServerItems([{ id, ...formData }]);
+            } else {
+                refreshStock();
+            }
         } else {
             showAlert(result.message, 'error');
         }
@@ -194,7 +523,7 @@ async function deleteProduct(id) {
 
         if (result.success) {
             showAlert(result.message, 'success');
-            refreshStock();
+            updateServerItems([], [id]);
         } else {
             showAlert(result.message, 'error');
         }
@@ -232,12 +561,21 @@ function updateSaleArticleSelect(filteredData = null) {
 
     const displayData = filteredData || stockData;
 
-    displayData.forEach(item => {
+    // A few hundred options at most, the search narrows large catalogs down
+    const fragment = document.createDocumentFragment();
+    displayData.slice(0, MAX_SALE_OPTIONS).forEach(item => {
         const option = document.createElement('option');
         option.value = item.id;
         option.textContent = `${item.nom_article} (Stock: ${item.stock})`;
-        select.appendChild(option);
+        fragment.appendChild(option);
     });
+    if (displayData.length > MAX_SALE_OPTIONS) {
+        const option = document.createElement('option');
+        option.disabled = true;
+        option.textContent = `… ${displayData.length - MAX_SALE_OPTIONS} autres articles, affinez la recherche`;
+        fragment.appendChild(option);
+    }
+    select.appendChild(fragment);
 
     // Add change event to show preview
     select.onchange = updateSalePreview;
@@ -250,7 +588,7 @@ function updateSaleArticleSelect(filteredData = null) {
 function filterSaleArticles() {
     const searchTerm = document.getElementById('saleSearch').value.toLowerCase();
     const filteredStock = stockData.filter(item =>
-        item.nom_article.toLowerCase().includes(searchTerm)
+        String(item.nom_article).toLowerCase().includes(searchTerm)
     );
     updateSaleArticleSelect(filteredStock);
 }
@@ -268,7 +606,7 @@ function updateSalePreview() {
         return;
     }
 
-    const article = stockData.find(item => item.id === articleId);
+    const article = stockById.get(articleId);
     if (!article) return;
 
     const total = article.prix * quantite;
@@ -294,30 +632,50 @@ function updateSalePreview() {
 
 /**
  * Process sale
+ *
+ * The sale is queued locally first and the stock updated at once; it is
+ * then sent to the server, or kept queued until the server is reachable.
  */
 async function processSale(event) {
     event.preventDefault();
 
-    const saleData = {
-        article_id: parseInt(document.getElementById('sale_article').value),
-        quantite: parseInt(document.getElementById('sale_quantite').value)
+    const articleId = parseInt(document.getElementById('sale_article').value);
+    const quantite = parseInt(document.getElementById('sale_quantite').value);
+    const article = stockById.get(articleId);
+
+    if (!article) {
+        showAlert('Article non trouvé', 'error');
+        return;
+    }
+    if (!Number.isInteger(article.stock) || article.prix === null) {
+        showAlert('Stock ou prix illisible dans stock.xlsx - corrigez l\'article avant de vendre', 'error');
+        return;
+    }
+    if (article.stock < quantite) {
+        showAlert(`Stock insuffisant! Disponible: ${article.stock}, Demandé: ${quantite}`, 'error');
+        return;
+    }
+
+    const sale = {
+        key: newIdempotencyKey(),
+        article_id: articleId,
+        quantite: quantite,
+        queuedAt: Date.now()
     };
 
     try {
-        const response = await fetch('/api/vente', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(saleData)
-        });
-
-        const result = await response.json();
+        await addPendingSale(sale);
+        closeSaleModal();
 
-        if (result.success) {
-            showAlert(result.message, 'success');
-            closeSaleModal();
-            refreshStock();
+        const outcome = await waitForSale(sale);
+        if (outcome.status === 'sent') {
+            showAlert(outcome.message, 'success');
+        } else if (outcome.status === 'rejected') {
+            showAlert(outcome.message, 'error');
         } else {
-            showAlert(result.message, 'error');
+            sale.reportedOffline = true;
+            savePendingSale(sale);
+            showAlert('Serveur injoignable: vente enregistrée localement, elle sera envoyée automatiquement', 'warning');
         }
     } catch (error) {
         showAlert('Erreur lors de la vente', 'error');
@@ -327,24 +685,25 @@ async function processSale(event) {
 
 /**
  * Check for low stock alerts
+ *
+ * Computed from the local catalog; each article is notified once when it
+ * goes low, and again only after it was restocked.
  */
-async function checkAlerts() {
-    try {
-        const response = await fetch('/api/alerts');
-        const alerts = await response.json();
-
-        if (alerts.length > 0) {
-            alerts.forEach(item => {
+function checkAlerts() {
+    stockById.forEach(item => {
+        if (isLowStock(item)) {
+            if (!alertedIds.has(item.id)) {
+                alertedIds.add(item.id);
                 // Show browser notification
                 showBrowserNotification(
                     'Alerte Stock Faible!',
                     `${item.nom_article}: Stock = ${item.stock} (Min: ${item.min_stock})`
                 );
-            });
+            }
+        } else {
+            alertedIds.delete(item.id);
         }
-    } catch (error) {
-        console.error('Error checking alerts:', error);
-    }
+    });
 }
 
 /**
@@ -389,23 +748,14 @@ function showAlert(message, type = 'success') {
  * Filter table by search input
  */
 function filterTable() {
-    const searchInput = document.getElementById('searchInput');
-    const filter = searchInput.value.toLowerCase();
-    const table = document.getElementById('stockTable');
-    const rows = table.getElementsByTagName('tr');
-
-    // Loop through all table rows (skip header)
-    for (let i = 1; i < rows.length; i++) {
-        const articleCell = rows[i].getElementsByTagName('td')[0];
-        if (articleCell) {
-            const articleName = articleCell.textContent || articleCell.innerText;
-            if (articleName.toLowerCase().indexOf(filter) > -1) {
-                rows[i].style.display = '';
-            } else {
-                rows[i].style.display = 'none';
-            }
-        }
-    }
+    stockFilter = document.getElementById('searchInput').value.toLowerCase();
+    rowById.forEach((row, id) => {
+        row.style.display = matchesStockFilter(stockById.get(id)) ? '' : 'none';
+    });
+}
+
+function matchesStockFilter(item) {
+    return !stockFilter || String(item.nom_article).toLowerCase().includes(stockFilter);
 }
 
 /**
@@ -600,8 +950,11 @@ window.onclick = function (event) {
  * Update sync status from server
  */
 async function updateSyncStatus() {
+    // No polling while the tab is in the background
+    if (document.hidden) return;
+
     try {
-        const response = await fetch('/api/sync/status');
+        const response = await fetchWithTimeout('/api/sync/status');
         const status = await response.json();
         renderSyncBadge(status);
     } catch (error) {
@@ -708,3 +1061,149 @@ async function triggerSync() {
         }, 1000);
     }
 }
+
+// ===== OFFLINE SALES QUEUE =====
+
+/**
+ * Queue a sale and show its effect on the stock immediately
+ */
+async function addPendingSale(sale) {
+    pendingSales.push(sale);
+    await savePendingSale(sale);
+    updateStockRows([sale.article_id]);
+    renderPendingCount();
+}
+
+function savePendingSale(sale) {
+    return withStore('outbox', 'readwrite', store => store.put(sale))
+        .catch(error => console.error('Outbox error:', error));
+}
+
+/**
+ * Drop a sale from the queue once the server has answered for it
+ */
+function removePendingSale(sale) {
+    pendingSales = pendingSales.filter(pending => pending.key !== sale.key);
+    withStore('outbox', 'readwrite', store => store.delete(sale.key))
+        .catch(error => console.error('Outbox error:', error));
+    renderPendingCount();
+}
+
+/**
+ * Send queued sales and resolve with the outcome of the given one
+ */
+async function waitForSale(sale) {
+    await flushOutbox();
+    if (!saleOutcomes.has(sale.key)) {
+        // Queued while a previous flush was finishing
+        await flushOutbox();
+    }
+    const outcome = saleOutcomes.get(sale.key) || { status: 'offline' };
+    saleOutcomes.delete(sale.key);
+    return outcome;
+}
+
+/**
+ * Send queued sales to the server, one flush at a time
+ */
+function flushOutbox() {
+    if (!flushPromise) {
+        flushPromise = drainOutbox().finally(() => {
+            flushPromise = null;
+        });
+    }
+    return flushPromise;
+}
+
+/**
+ * Send queued sales in order, stopping at the first one the server cannot take
+ *
+ * Each sale carries its Idempotency-Key, so a sale whose response was lost
+ * is not applied twice when it is sent again. Only unreachable servers are
+ * retried: a sale the server answered with an error is reported, never
+ * sent again behind the user's back.
+ */
+async function drainOutbox() {
+    let resent = 0;
+    let reload = false;
+
+    while (pendingSales.length > 0) {
+        const sale = pendingSales[0];
+        // Counted before sending, so a page reload knows the sale may have reached the server
+        sale.attempts = (sale.attempts || 0) + 1;
+        await savePendingSale(sale);
+
+        let response;
+        try {
+            response = await fetchWithTimeout('/api/vente', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': sale.key
+                },
+                body: JSON.stringify({ article_id: sale.article_id, quantite: sale.quantite })
+            });
+        } catch (error) {
+            saleOutcomes.set(sale.key, { status: 'offline' });
+            break;
+        }
+
+        const result = await response.json().catch(() => ({}));
+        removePendingSale(sale);
+
+        const item = serverItems.get(sale.article_id);
+        if (response.ok && result.success) {
+            // Take the stock the server reports rather than subtracting the sale:
+            // a refresh may already have loaded a catalog that includes it
+            if (item && Number.isInteger(result.stock)) {
+                updateServerItems([{ ...item, stock: result.stock }]);
+            }
+            // A resent sale gets the response stored at its first attempt,
+            // whose stock may be outdated: reload the catalog in that case only
+            if (sale.attempts > 1) reload = true;
+            saleOutcomes.set(sale.key, { status: 'sent', message: result.message });
+            if (sale.reportedOffline) resent++;
+        } else if (response.status >= 500) {
+            // The server failed: show it and let the user decide, the stock
+            // may have changed (result.applied) or be unknown without a message
+            updateStockRows([sale.article_id]);
+            if (result.applied || !result.message) reload = true;
+            const message = result.applied
+                ? result.message
+                : `Vente non confirmée: ${result.message || `erreur serveur ${response.status}`} - vérifiez le stock avant de la refaire`;
+            saleOutcomes.set(sale.key, { status: 'rejected', message });
+            if (sale.reportedOffline) {
+                showAlert(`Vente hors ligne (${item ? item.nom_article : 'article supprimé'}): ${message}`, 'error');
+            }
+        } else {
+            // Refused (e.g. stock sold out meanwhile): undo the optimistic update
+            updateStockRows([sale.article_id]);
+            const message = result.message || 'Vente refusée par le serveur';
+            saleOutcomes.set(sale.key, { status: 'rejected', message });
+            if (sale.reportedOffline) {
+                showAlert(`Vente hors ligne refusée (${item ? item.nom_article : 'article supprimé'}): ${message}`, 'error');
+            }
+        }
+    }
+
+    if (reload) {
+        // Without If-None-Match: the cached ETag may match a stale local copy
+        stockEtag = null;
+        saveMeta('stockEtag', null);
+        refreshStock();
+    }
+
+    if (resent > 0) {
+        showAlert(`${resent} vente(s) enregistrée(s) hors ligne envoyée(s) au serveur`, 'success');
+    }
+}
+
+/**
+ * Show the number of queued sales next to the sync badge
+ */
+function renderPendingCount() {
+    const badge = document.getElementById('pendingSalesBadge');
+    if (!badge) return;
+    badge.textContent = `⏳ ${pendingSales.length} vente(s) en attente`;
+    badge.style.display = pendingSales.length > 0 ? 'inline-flex' : 'none';
+}
@@ -0,0 +1,212 @@
+"""
+Stock Storage Module
+Keeps the stock table in memory with fixed dtypes and an id -> row index
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library encoder
+    orjson = None
+
+STOCK_COLUMNS = ['id', 'nom_article', 'stock', 'prix', 'min_stock']
+STOCK_DTYPES = {
+    'id': 'int64',
+    'nom_article': 'category',
+    'stock': 'Int32',
+    'prix': 'float64',
+    'min_stock': 'Int32',
+}
+
+# In-memory copy of stock.xlsx, reloaded only when the file changes on disk
+_cache = {
+    'df': None,
+    'mtime': None,
+    'version': 0,
+    'body': None,
+    'gzip_body': None,
+    'etag': None,
+}
+_lock = threading.Lock()
+
+
+def empty_stock():
+    """Return an empty typed stock DataFrame"""
+    return to_typed(pd.DataFrame(columns=STOCK_COLUMNS))
+
+
+def _repair_ids(ids):
+    """
+    Give a fresh id to every article whose id is missing, invalid or repeated
+
+    The first article keeping a given id is left untouched; the others are
+    numbered after the largest valid id, so the repair is the same on every
+    read of the file until it is saved.
+    """
+    ids = pd.to_numeric(ids, errors='coerce').astype('float64')
+    valid = np.isfinite(ids) & (ids == ids.round())
+    bad = ~valid | (valid & ids.duplicated())
+    if bad.any():
+        next_id = int(ids[~bad].max()) + 1 if (~bad).any() else 1
+        new_ids = np.arange(next_id, next_id + int(bad.sum()))
+        print(f"⚠️ {len(new_ids)} article(s) sans identifiant valide ou en double dans le stock - "
+              f"nouveaux identifiants {new_ids[0]} à {new_ids[-1]}")
+        ids = ids.copy()
+        ids[bad] = new_ids
+    return ids.astype('int64')
+
+
+def to_typed(df):
+    """
+    Convert a stock DataFrame to its compact typed form
+
+    Numeric columns get fixed dtypes, names become categorical and the
+    index holds the article ids so `df.loc[item_id]` is a hash lookup.
+    Unreadable stock or price cells stay missing (NA) rather than becoming
+    0, so they are never written back as real values; ids are repaired by
+    _repair_ids since every lookup depends on them.
+    """
+    df = df.reindex(columns=STOCK_COLUMNS)
+    typed = {}
+    for column, dtype in STOCK_DTYPES.items():
+        if column == 'id':
+            typed[column] = _repair_ids(df[column])
+        elif dtype == 'category':
+            typed[column] = df[column].fillna('').astype(str).astype('category')
+            typed[column] = typed[column].cat.remove_unused_categories()
+        else:
+            values = pd.to_numeric(df[column], errors='coerce').astype('float64')
+            values = values.where(np.isfinite(values))
+            typed[column] = (values if dtype == 'float64' else values.round()).astype(dtype)
+    typed = pd.DataFrame(typed, columns=STOCK_COLUMNS)
+    typed.index = pd.Index(typed['id'].to_numpy(), name=None)
+    return typed
+
+
+def set_item(df, item_id, values):
+    """
+    Assign column values on one article in place
+
+    Args:
+        df: Typed stock DataFrame
+        item_id: Article id
+        values: dict of column -> new value
+    """
+    name = values.get('nom_article')
+    if name is not None and name not in df['nom_article'].cat.categories:
+        df['nom_article'] = df['nom_article'].cat.add_categories([name])
+    for column, value in values.items():
+        df.at[item_id, column] = value
+
+
+def _file_mtime(stock_file):
+    try:
+        return os.stat(stock_file).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load(stock_file):
+    """
+    Get the cached typed stock table, re-reading the file if it changed
+
+    The returned DataFrame is shared: copy it before mutating.
+    """
+    mtime = _file_mtime(stock_file)
+    with _lock:
+        if _cache['df'] is None or _cache['mtime'] != mtime:
+            df = pd.read_excel(stock_file) if mtime is not None else pd.DataFrame(columns=STOCK_COLUMNS)
+            _set_cache(to_typed(df), mtime)
+        return _cache['df']
+
+
+def save(stock_file, df):
+    """
+    Write the stock table to Excel and make it the cached version
+
+    Returns:
+        The typed DataFrame that was written
+    """
+    df = to_typed(df)
+    df.to_excel(stock_file, index=False)
+    with _lock:
+        _set_cache(df, _file_mtime(stock_file))
+    return df
+
+
+def _set_cache(df, mtime):
+    """Replace the cached table and invalidate everything derived from it"""
+    _cache['df'] = df
+    _cache['mtime'] = mtime
+    _cache['version'] += 1
+    _cache['body'] = None
+    _cache['gzip_body'] = None
+    _cache['etag'] = None
+
+
+def data_version():
+    """Counter bumped every time the cached stock table changes"""
+    return _cache['version']
+
+
+def _json_values(series):
+    """List a column's values, with missing and non-finite numbers as None"""
+    if series.dtype.kind == 'f':
+        values = series.to_numpy()
+        finite = np.isfinite(values)
+        if finite.all():
+            return values.tolist()
+        return np.where(finite, values.astype(object), None).tolist()
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+def records(df):
+    """Convert a DataFrame (stock, report or suggestion rows) to JSON-ready row dicts"""
+    names = list(df.columns)
+    columns = [_json_values(df[column]) for column in names]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def dumps(payload):
+    """Encode a payload to JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encoded_stock(stock_file, compressed=False):
+    """
+    Get the JSON body of the full stock list
+
+    The body (and its gzip form) is encoded once per data version and
+    reused until the next mutation.
+
+    Args:
+        stock_file: Path to stock.xlsx
+        compressed: Return the gzip-compressed body
+    """
+    load(stock_file)
+    with _lock:
+        if _cache['body'] is None:
+            _cache['body'] = dumps(records(_cache['df']))
+            _cache['etag'] = hashlib.sha1(_cache['body']).hexdigest()[:20]
+        if not compressed:
+            return _cache['body']
+        if _cache['gzip_body'] is None:
+            _cache['gzip_body'] = gzip.compress(_cache['body'], compresslevel=5)
+        return _cache['gzip_body']
+
+
+def stock_etag(stock_file):
+    """Get the ETag of the current stock list (a hash of its JSON body)"""
+    encoded_stock(stock_file)
+    return _cache['etag']